@@ -14,6 +14,8 @@ DEFAULT_PASSWORD = 'secure123'
 # Connection Settings
 CONNECTION_TIMEOUT = 10
 KEEPALIVE_INTERVAL = 30
+# Kernel send/receive buffer for the tunnel socket (bulk transfers)
+SOCKET_BUFFER_SIZE = 4 * 1024 * 1024
 
 # Demo Site URL - Access through VPN or direct (will be blocked)
 DEMO_SITE_URL = 'http://192.168.0.105:9000'  # VM1's demo site
@@ -4,12 +4,79 @@ Listens on localhost:8080, forwards through VPN to destination
 """
 
 import socket
+import selectors
 import threading
 import logging
+from concurrent.futures import ThreadPoolExecutor
+from contextlib import closing
+from functools import lru_cache
 from typing import Optional
+from urllib.parse import urlparse
+
+try:
+    import httptools
+except ImportError:  # Optional C parser - fall back to the pure-Python header split
+    httptools = None
 
 logging.basicConfig(level=logging.INFO, format='[PROXY] %(message)s')
 
+# Maximum size of a request header block read from the browser
+REQUEST_BUFFER_SIZE = 131072
+
+# Connections accepted per wakeup of the accept loop
+ACCEPT_BATCH = 32
+
+# Hop-by-hop headers from the browser; the VPN client keeps its own
+# destination connections alive, so these are not passed on
+HOP_BY_HOP_HEADERS = (b'connection', b'proxy-connection', b'keep-alive')
+
+
+@lru_cache(maxsize=512)
+def _parse_url(url: str) -> tuple:
+    """
+    Split an absolute proxy URL into (host, port, path)
+    
+    Cached because a browser session requests the same origins over and over.
+    """
+    parsed = urlparse(url)
+    port = parsed.port if parsed.port else (443 if parsed.scheme == 'https' else 80)
+    return parsed.hostname, port, parsed.path if parsed.path else '/'
+
+
+@lru_cache(maxsize=512)
+def _parse_host_header(value: bytes) -> tuple:
+    """Split a Host header value into (host, port), port None if absent or invalid"""
+    host_value = value.decode('latin-1').strip()
+    if ':' in host_value:
+        host, port_str = host_value.rsplit(':', 1)
+        try:
+            return host, int(port_str)
+        except:
+            return host, None
+    return host_value, None
+
+
+class _RequestParser:
+    """Collects the request target and headers from httptools callbacks"""
+    
+    def __init__(self):
+        self.url = b''
+        self.headers = []
+        self.headers_complete = False
+        self.parser = httptools.HttpRequestParser(self)
+        
+    def feed(self, data: bytes):
+        self.parser.feed_data(data)
+        
+    def on_url(self, url: bytes):
+        self.url += url
+        
+    def on_header(self, name: bytes, value: bytes):
+        self.headers.append((name, value))
+        
+    def on_headers_complete(self):
+        self.headers_complete = True
+
 
 class LocalProxy:
     """Simple HTTP proxy that forwards through VPN tunnel"""
@@ -20,6 +87,7 @@ class LocalProxy:
         self.running = False
         self.server_socket: Optional[socket.socket] = None
         self.proxy_thread: Optional[threading.Thread] = None
+        self.pool: Optional[ThreadPoolExecutor] = None
         
     def start(self):
         """Start the local proxy server"""
@@ -27,12 +95,15 @@ class LocalProxy:
             return
             
         self.running = True
+        # Reuse a bounded set of worker threads instead of one thread per connection
+        self.pool = ThreadPoolExecutor(max_workers=64, thread_name_prefix='proxy-worker')
         self.server_socket = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
         self.server_socket.setsockopt(socket.SOL_SOCKET, socket.SO_REUSEADDR, 1)
         
         try:
             self.server_socket.bind(('127.0.0.1', self.local_port))
-            self.server_socket.listen(5)
+            self.server_socket.listen(socket.SOMAXCONN)
+            self.server_socket.setblocking(False)
             logging.info(f"Local proxy listening on http://localhost:{self.local_port}")
             logging.info("Configure your browser to use this proxy")
             
@@ -42,6 +113,8 @@ class LocalProxy:
         except Exception as e:
             logging.error(f"Failed to start proxy: {e}")
             self.running = False
+            self.pool.shutdown(wait=False)
+            self.pool = None
             
     def stop(self):
         """Stop the proxy server"""
@@ -51,60 +124,193 @@ class LocalProxy:
                 self.server_socket.close()
             except:
                 pass
+        if self.pool:
+            self.pool.shutdown(wait=False)
+            self.pool = None
         logging.info("Local proxy stopped")
         
     def _accept_loop(self):
-        """Accept incoming connections"""
-        while self.running:
-            try:
-                client_socket, addr = self.server_socket.accept()
-                logging.info(f"Proxy connection from {addr}")
+        """
+        Accept incoming connections
+        
+        Waits for the listening socket to become readable, then drains up
+        to ACCEPT_BATCH pending connections into the worker pool before
+        waiting again, so a burst costs one wakeup instead of one per
+        connection.
+        """
+        with selectors.DefaultSelector() as selector:
+            selector.register(self.server_socket, selectors.EVENT_READ)
+            while self.running:
+                try:
+                    if not selector.select(timeout=0.1):
+                        continue
+                    for _ in range(ACCEPT_BATCH):
+                        try:
+                            client_socket, addr = self.server_socket.accept()
+                        except BlockingIOError:
+                            break
+                        logging.info(f"Proxy connection from {addr}")
+                        
+                        self.pool.submit(self._handle_client, client_socket)
+                        
+                except Exception as e:
+                    if self.running:
+                        logging.error(f"Accept error: {e}")
+                    
+    def _read_request(self, client_socket: socket.socket) -> Optional[tuple]:
+        """
+        Read the request line and headers from a browser connection
+        
+        Uses the httptools (llhttp) parser when available, otherwise
+        splits the header block in Python.
+        
+        Returns:
+            Tuple of (method, target, headers, body_start) as bytes, where
+            headers is a list of (name, value) pairs and body_start holds any
+            body bytes read along with the headers, or None if no request
+            was read
+        """
+        parser = _RequestParser() if httptools else None
+        
+        # Read into one fixed buffer (also caps request size)
+        buf = bytearray(REQUEST_BUFFER_SIZE)
+        view = memoryview(buf)
+        received = 0
+        header_end = -1
+        
+        while header_end == -1 and received < len(buf):
+            count = client_socket.recv_into(view[received:])
+            if not count:
+                break
+            
+            if parser:
+                try:
+                    parser.feed(bytes(view[received:received + count]))
+                except (httptools.HttpParserError, httptools.HttpParserUpgrade):
+                    # CONNECT and Upgrade requests stop the parser once the
+                    # headers are in, which is all that is needed here
+                    if not parser.headers_complete:
+                        parser = None  # Let the Python path have a go at it
+            
+            # Only the newly written bytes (plus 3 for a split terminator) need
+            # scanning; the hit is kept so the header block is never rescanned
+            scan_start = max(0, received - 3)
+            received += count
+            header_end = buf.find(b'\r\n\r\n', scan_start, received)
                 
-                thread = threading.Thread(
-                    target=self._handle_client,
-                    args=(client_socket,),
-                    daemon=True
-                )
-                thread.start()
+        if not received:
+            return None
+        
+        if header_end == -1:
+            header_end = received  # Unterminated: parse what arrived
+            body_start = b''
+        else:
+            body_start = bytes(view[header_end + 4:received])
+            
+        if parser and parser.headers_complete:
+            return parser.parser.get_method(), parser.url, parser.headers, body_start
+            
+        # Parse first line: GET http://host:port/path HTTP/1.1 or GET /path HTTP/1.1
+        lines = bytes(view[:header_end]).split(b'\r\n')
+        parts = lines[0].split()
+        if len(parts) < 2:
+            return None
+            
+        headers = []
+        for line in lines[1:]:
+            if not line:
+                break  # End of headers
+            name, sep, value = line.partition(b':')
+            if sep:
+                headers.append((name.strip(), value.strip()))
                 
-            except Exception as e:
-                if self.running:
-                    logging.error(f"Accept error: {e}")
+        return parts[0], parts[1], headers, body_start
+    
+    def _read_body(self, client_socket: socket.socket, headers: list, body_start: bytes) -> bytes:
+        """
+        Read the request body framed by Content-Length or chunked encoding
+        
+        Chunked bodies are passed on still encoded, so the destination
+        sees the same framing the browser sent.
+        
+        Args:
+            client_socket: Browser connection
+            headers: Request headers as (name, value) pairs
+            body_start: Body bytes already read with the headers
+            
+        Returns:
+            Raw body bytes (empty if the request has none)
+        """
+        content_length = None
+        chunked = False
+        for name, value in headers:
+            name = name.lower()
+            if name == b'content-length':
+                content_length = int(value)
+            elif name == b'transfer-encoding':
+                chunked = value.lower().endswith(b'chunked')
+                
+        if chunked:
+            body = bytearray(body_start)
+            
+            def find_crlf(start: int) -> int:
+                index = body.find(b'\r\n', start)
+                while index == -1:
+                    scan_start = max(start, len(body) - 1)
+                    chunk = client_socket.recv(65536)
+                    if not chunk:
+                        raise ConnectionError("Browser closed mid-body")
+                    body.extend(chunk)
+                    index = body.find(b'\r\n', scan_start)
+                return index
+            
+            pos = 0
+            while True:
+                line_end = find_crlf(pos)
+                size = int(bytes(body[pos:line_end]).split(b';')[0], 16)
+                pos = line_end + 2
+                if size == 0:
+                    # Optional trailer lines, then a blank line
+                    line_end = find_crlf(pos)
+                    while line_end > pos:
+                        pos = line_end + 2
+                        line_end = find_crlf(pos)
+                    return bytes(body[:line_end + 2])
+                pos += size + 2
+                while len(body) < pos:
+                    chunk = client_socket.recv(max(pos - len(body), 65536))
+                    if not chunk:
+                        raise ConnectionError("Browser closed mid-body")
+                    body.extend(chunk)
                     
+        if not content_length:
+            return b''
+            
+        # Read the rest of the body straight into one preallocated buffer
+        body = bytearray(content_length)
+        view = memoryview(body)
+        received = min(len(body_start), content_length)
+        view[:received] = body_start[:received]
+        while received < content_length:
+            count = client_socket.recv_into(view[received:])
+            if not count:
+                raise ConnectionError("Browser closed mid-body")
+            received += count
+        return bytes(body)
+        
     def _handle_client(self, client_socket: socket.socket):
         """Handle a proxy client connection"""
         try:
             # Read HTTP request with timeout
             client_socket.settimeout(5.0)
-            request_data = b''
-            
-            while b'\r\n\r\n' not in request_data:
-                chunk = client_socket.recv(4096)
-                if not chunk:
-                    break
-                request_data += chunk
-                if len(request_data) > 100000:  # Limit request size
-                    break
-                    
-            if not request_data:
+            request = self._read_request(client_socket)
+            if request is None:
                 return
                 
-            # Parse request
-            request_str = request_data.decode('utf-8', errors='ignore')
-            lines = request_str.split('\r\n')
-            
-            if not lines:
-                return
-                
-            # Parse first line: GET http://host:port/path HTTP/1.1 or GET /path HTTP/1.1
-            first_line = lines[0]
-            parts = first_line.split()
-            
-            if len(parts) < 2:
-                return
-                
-            method = parts[0]
-            url_or_path = parts[1]
+            method_b, target_b, headers, body_start = request
+            body = self._read_body(client_socket, headers, body_start)
+            method = method_b.decode('latin-1')
+            url_or_path = target_b.decode('latin-1')
             
             # Parse destination from URL (for proxy requests) or Host header
             host = None
@@ -114,27 +320,17 @@ class LocalProxy:
             # Check if full URL is in request line (proxy mode)
             if url_or_path.startswith('http://') or url_or_path.startswith('https://'):
                 # Parse: http://192.168.0.105:9000/path
-                from urllib.parse import urlparse
-                parsed = urlparse(url_or_path)
-                host = parsed.hostname
-                port = parsed.port if parsed.port else (443 if parsed.scheme == 'https' else 80)
-                path = parsed.path if parsed.path else '/'
+                host, port, path = _parse_url(url_or_path)
                 logging.info(f"📍 Extracted from URL: {host}:{port}{path}")
             
             # Fallback: Parse from Host header
             if not host:
-                for line in lines[1:]:
-                    if line.lower().startswith('host:'):
-                        host_value = line.split(':', 1)[1].strip()
+                for name, value in headers:
+                    if name.lower() == b'host':
                         # Parse host:port from Host header
-                        if ':' in host_value:
-                            host, port_str = host_value.rsplit(':', 1)
-                            try:
-                                port = int(port_str)
-                            except:
-                                pass
-                        else:
-                            host = host_value
+                        host, header_port = _parse_host_header(value)
+                        if header_port:
+                            port = header_port
                         break
             
             # Final fallback
@@ -144,31 +340,26 @@ class LocalProxy:
                     
             logging.info(f"🔒 Forwarding {method} {path} to {host}:{port} through encrypted VPN tunnel")
             
-            # Reconstruct HTTP request with path only (not full URL)
-            reconstructed_request = f"{method} {path} HTTP/1.1\r\n"
-            for line in lines[1:]:
-                if line.strip():  # Skip empty lines
-                    reconstructed_request += line + "\r\n"
-            reconstructed_request += "\r\n"
-            
-            # Forward through VPN tunnel (returns raw response bytes)
-            success, response = self.vpn_client.forward_traffic(
-                host, port, reconstructed_request
-            )
-            
-            if success and response:
-                # Response is dict, extract data
-                if isinstance(response, dict):
-                    response_data = response.get('data', '')
-                    if isinstance(response_data, str):
-                        # Decode from latin-1 (HTTP response encoding)
-                        response_data = response_data.encode('latin-1')
-                    client_socket.sendall(response_data)
-                    logging.info(f"✓ Response: {len(response_data)} bytes forwarded through VPN")
-                else:
-                    client_socket.sendall(str(response).encode())
-                    logging.info(f"✓ Response received ({len(response)} bytes)")
-            else:
+            # Reconstruct HTTP request with path only (not full URL), in one bytes join
+            request_line = b"%s %s HTTP/1.1" % (method_b, path.encode('latin-1'))
+            reconstructed_request = b"\r\n".join(
+                [request_line] + [name + b": " + value for name, value in headers
+                                  if name.lower() not in HOP_BY_HOP_HEADERS]
+            ) + b"\r\n\r\n" + body
+            
+            # Forward through VPN tunnel, passing the response on as it arrives.
+            # Responses over STREAM_BUFFER_SIZE are written with the tunnel
+            # locked, so a stalled browser holds up other requests until the
+            # socket timeout below gives up on it
+            forwarded = 0
+            try:
+                with closing(self.vpn_client.forward_stream(host, port, reconstructed_request)) as stream:
+                    for chunk in stream:
+                        client_socket.sendall(chunk)
+                        forwarded += len(chunk)
+            except Exception as e:
+                if forwarded:
+                    raise
                 # Send error
                 error_response = (
                     b"HTTP/1.1 502 Bad Gateway\r\n"
@@ -178,7 +369,10 @@ class LocalProxy:
                     b"<h1>VPN Tunnel Error</h1><p>Could not forward request through VPN.</p>"
                 )
                 client_socket.sendall(error_response)
-                logging.error(f"✗ Failed to forward through VPN: {response}")
+                logging.error(f"✗ Failed to forward through VPN: {e}")
+                return
+                
+            logging.info(f"✓ Response: {forwarded} bytes forwarded through VPN")
                 
         except socket.timeout:
             logging.error("✗ Timeout reading client request")
@@ -28,8 +28,8 @@ class VPNClient:
         self.server_public_key = None
         self.connected = False
         
-        # Initialize encryption handler
-        self.encryption = EncryptionHandler()
+        # Session encryption handler, created once the AES key exists
+        self.encryption = None
     
     def connect(self, username: str, password: str) -> tuple:
         """
@@ -56,6 +56,7 @@ class VPNClient:
             self.aes_key = os.urandom(32)  # 256-bit key
             encrypted_aes_key = RSAHandler.encrypt_rsa(self.aes_key, self.server_public_key)
             self.socket.send(encrypted_aes_key)
+            self.encryption = EncryptionHandler(self.aes_key)
             
             # Step 3: Send authentication credentials
             auth_data = json.dumps({
@@ -63,12 +64,12 @@ class VPNClient:
                 'password': password,
                 'timestamp': time.time()
             })
-            encrypted_auth = self.encryption.encrypt_aes(auth_data, self.aes_key)
+            encrypted_auth = self.encryption.encrypt(auth_data)
             self.socket.send(encrypted_auth)
             
             # Step 4: Receive authentication response
             encrypted_response = self.socket.recv(1024)
-            response = json.loads(self.encryption.decrypt_aes(encrypted_response, self.aes_key))
+            response = json.loads(self.encryption.decrypt(encrypted_response))
             
             if response['status'] == 'success':
                 self.connected = True
@@ -93,6 +94,7 @@ class VPNClient:
                 pass
         self.socket = None
         self.aes_key = None
+        self.encryption = None
         self._update_access_control('blocked')
     
     def send_data(self, data: str) -> tuple:
@@ -109,12 +111,12 @@ class VPNClient:
             return False, "Not connected to VPN"
         
         try:
-            encrypted_data = self.encryption.encrypt_aes(data, self.aes_key)
+            encrypted_data = self.encryption.encrypt(data)
             self.socket.send(encrypted_data)
             
             # Receive acknowledgment
             encrypted_ack = self.socket.recv(1024)
-            ack = json.loads(self.encryption.decrypt_aes(encrypted_ack, self.aes_key))
+            ack = json.loads(self.encryption.decrypt(encrypted_ack))
             return True, ack
         except Exception as e:
             return False, str(e)
@@ -9,14 +9,56 @@ import os
 import time
 import sys
 import threading
+from collections import OrderedDict
+from contextlib import closing
 from typing import Optional
 
 sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
 
-from shared.encryption import EncryptionHandler, RSAHandler
-from shared.constants import DEFAULT_BUFFER_SIZE, ACCESS_CONTROL_FILE
+from shared.encryption import EncryptionHandler, RSAHandler, TunnelCipher, CIPHER_AES_GCM, preferred_cipher_suites
+from shared.framing import send_frame, recv_exact, LENGTH_PREFIX
+from shared.commands import CMD_STATS, CMD_OPEN, CMD_SEND, CMD_CLOSE, pack_address, pack_connection, pack_auth
+from shared.constants import DEFAULT_BUFFER_SIZE, ACCESS_CONTROL_FILE, FORWARD_OK_HEADER, STREAM_OK_HEADER
 from . import config
 
+# Maximum number of persistent destination connections kept open through the tunnel
+MAX_REMOTE_CONNS = 64
+
+# Streamed response body read ahead per request, so the tunnel is unlocked
+# before the caller writes it out (one per proxy worker at most)
+STREAM_BUFFER_SIZE = 1024 * 1024
+
+# Parsed forms of the fixed reply status lines, so they skip json.loads
+FIXED_REPLY_HEADERS = {
+    FORWARD_OK_HEADER.rstrip(b'\n'): {'status': 'success'},
+    STREAM_OK_HEADER.rstrip(b'\n'): {'status': 'success', 'stream': True},
+}
+
+
+# Loaded server public keys by PEM, so reconnects skip the PEM/ASN.1 parse
+PUBLIC_KEY_CACHE_SIZE = 8
+_public_key_cache = {}
+
+
+def _load_server_public_key(public_pem: bytes):
+    """Load a server public key, reusing the key object for a PEM seen before"""
+    key = _public_key_cache.get(public_pem)
+    if key is None:
+        key = RSAHandler.load_public_key(public_pem)
+        if len(_public_key_cache) >= PUBLIC_KEY_CACHE_SIZE:
+            # FIFO eviction: dicts keep insertion order
+            del _public_key_cache[next(iter(_public_key_cache))]
+        _public_key_cache[public_pem] = key
+    return key
+
+
+def _parse_reply_header(header: bytes) -> dict:
+    """Decode a tunnel reply status line, matching the fixed ones as bytes"""
+    fixed = FIXED_REPLY_HEADERS.get(header)
+    if fixed is not None:
+        return dict(fixed)
+    return json.loads(header)
+
 
 class VPNClientEnhanced:
     """
@@ -26,33 +68,44 @@ class VPNClientEnhanced:
     - Packet forwarding through VPN tunnel
     - Flow control awareness
     - Connection statistics
-    - Keepalive mechanism
+    - Keepalive mechanism (TCP keepalive)
     """
     
+    # Fixed attribute layout: per-packet counter updates are plain slot stores
+    __slots__ = (
+        'server_host', 'server_port', 'socket', 'aes_key', 'cipher',
+        'server_public_key', 'connected', 'encryption',
+        'bytes_sent', 'bytes_received', 'packets_sent', 'packets_received',
+        'connection_start', 'last_rtt',
+        'tunnel_lock', 'remote_conns', 'conns_lock'
+    )
+    
     def __init__(self):
         self.server_host = config.DEFAULT_SERVER_HOST
         self.server_port = config.DEFAULT_SERVER_PORT
         self.socket = None
         self.aes_key = None
+        self.cipher = None
         self.server_public_key = None
         self.connected = False
         
-        # Initialize encryption handler
-        self.encryption = EncryptionHandler()
+        # Handshake encryption handler, created once the AES key exists
+        self.encryption = None
         
         # Statistics
-        self.stats = {
-            'bytes_sent': 0,
-            'bytes_received': 0,
-            'packets_sent': 0,
-            'packets_received': 0,
-            'connection_start': 0,
-            'last_rtt': 0
-        }
+        self.bytes_sent = 0
+        self.bytes_received = 0
+        self.packets_sent = 0
+        self.packets_received = 0
+        self.connection_start = 0
+        self.last_rtt = 0
+        
+        # Serializes request/response exchanges on the shared tunnel socket
+        self.tunnel_lock = threading.Lock()
         
-        # Keepalive thread
-        self.keepalive_thread = None
-        self.keepalive_running = False
+        # Persistent destination connections: (host, port) -> server conn id, LRU order
+        self.remote_conns = OrderedDict()
+        self.conns_lock = threading.Lock()
     
     def connect(self, username: str, password: str) -> tuple:
         """
@@ -72,74 +125,62 @@ class VPNClientEnhanced:
             self.socket = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
             self.socket.settimeout(config.CONNECTION_TIMEOUT)
             
-            # Enable TCP keepalive
+            # Enable TCP keepalive; the kernel probes an idle tunnel, so no
+            # application-level keepalive thread is needed
             self.socket.setsockopt(socket.SOL_SOCKET, socket.SO_KEEPALIVE, 1)
+            if hasattr(socket, 'TCP_KEEPIDLE'):  # Linux-only tuning
+                self.socket.setsockopt(socket.IPPROTO_TCP, socket.TCP_KEEPIDLE, config.KEEPALIVE_INTERVAL)
+                self.socket.setsockopt(socket.IPPROTO_TCP, socket.TCP_KEEPINTVL, config.KEEPALIVE_INTERVAL)
+                self.socket.setsockopt(socket.IPPROTO_TCP, socket.TCP_KEEPCNT, 3)
             # Disable Nagle's algorithm for lower latency
             self.socket.setsockopt(socket.IPPROTO_TCP, socket.TCP_NODELAY, 1)
+            # Room for bulk downloads on high-latency links (set before connect)
+            self.socket.setsockopt(socket.SOL_SOCKET, socket.SO_RCVBUF, config.SOCKET_BUFFER_SIZE)
+            self.socket.setsockopt(socket.SOL_SOCKET, socket.SO_SNDBUF, config.SOCKET_BUFFER_SIZE)
             
             print(f"[CLIENT] Connecting to {self.server_host}:{self.server_port}...")
             self.socket.connect((self.server_host, self.server_port))
             
             # Step 1: Receive server's public key
             print("[CLIENT] Receiving server public key...")
-            public_pem = self.socket.recv(2048)
-            self.server_public_key = RSAHandler.load_public_key(public_pem)
+            key_len = LENGTH_PREFIX.unpack(self._recv_exact(4))[0]
+            public_pem = self._recv_exact(key_len)
+            self.server_public_key = _load_server_public_key(public_pem)
             print("[CLIENT] ✓ RSA-2048 public key received")
             
             # Step 2: Generate AES key and encrypt with server's public key
             print("[CLIENT] Generating AES-256 session key...")
             self.aes_key = os.urandom(32)  # 256-bit key
             encrypted_aes_key = RSAHandler.encrypt_rsa(self.aes_key, self.server_public_key)
-            # Send with length prefix for reliable transmission
-            key_len = len(encrypted_aes_key)
-            self.socket.sendall(key_len.to_bytes(4, 'big'))
-            self.socket.sendall(encrypted_aes_key)
+            # Send with length prefix for reliable transmission (one write per frame)
+            send_frame(self.socket, encrypted_aes_key)
             print("[CLIENT] ✓ Encrypted session key sent")
+            self.encryption = EncryptionHandler(self.aes_key)
             
             # Step 3: Send authentication credentials
             print("[CLIENT] Authenticating...")
-            auth_data = json.dumps({
-                'username': username,
-                'password': password,
-                'timestamp': time.time(),
-                'client_version': '2.0'
-            })
-            encrypted_auth = self.encryption.encrypt_aes(auth_data, self.aes_key)
-            # Send length first, then data
-            auth_len = len(encrypted_auth)
-            self.socket.sendall(auth_len.to_bytes(4, 'big'))
-            self.socket.sendall(encrypted_auth)
+            # Fixed binary layout (shared.commands) - no JSON to build or parse
+            auth_data = pack_auth(username, password, time.time(), preferred_cipher_suites())
+            encrypted_auth = self.encryption.encrypt(auth_data)
+            # Send length and data together
+            send_frame(self.socket, encrypted_auth)
             
             # Step 4: Receive authentication response (with length prefix)
-            resp_len_bytes = b''
-            while len(resp_len_bytes) < 4:
-                chunk = self.socket.recv(4 - len(resp_len_bytes))
-                if not chunk:
-                    return False, "Connection closed during response length receive", {}
-                resp_len_bytes += chunk
+            resp_len = LENGTH_PREFIX.unpack(self._recv_exact(4))[0]
+            encrypted_response = self._recv_exact(resp_len)
             
-            if len(resp_len_bytes) != 4:
-                return False, "Failed to receive response length", {}
-            resp_len = int.from_bytes(resp_len_bytes, 'big')
-            
-            # Receive all response data
-            encrypted_response = b''
-            while len(encrypted_response) < resp_len:
-                chunk = self.socket.recv(min(resp_len - len(encrypted_response), 4096))
-                if not chunk:
-                    return False, "Connection closed during response", {}
-                encrypted_response += chunk
-                
-            response = json.loads(self.encryption.decrypt_aes(encrypted_response, self.aes_key))
+            response = json.loads(self.encryption.decrypt(encrypted_response))
             
             connection_time = time.time() - connection_start
             
             if response['status'] == 'success':
+                # Tunnel frames after the handshake reuse one cipher context per
+                # direction, using the suite the server picked (servers that
+                # predate negotiation always use AES-GCM)
+                cipher_suite = response.get('cipher_suite', CIPHER_AES_GCM)
+                self.cipher = TunnelCipher(self.aes_key, is_client=True, cipher_suite=cipher_suite)
                 self.connected = True
-                self.stats['connection_start'] = time.time()
-                
-                # Start keepalive
-                self._start_keepalive()
+                self.connection_start = time.time()
                 
                 server_info = response.get('server_info', {})
                 features = server_info.get('features', [])
@@ -163,9 +204,6 @@ class VPNClientEnhanced:
         """Disconnect from VPN server"""
         print("[CLIENT] Disconnecting...")
         
-        # Stop keepalive
-        self._stop_keepalive()
-        
         self.connected = False
         if self.socket:
             try:
@@ -174,148 +212,243 @@ class VPNClientEnhanced:
                 pass
         self.socket = None
         self.aes_key = None
+        self.encryption = None
+        self.cipher = None
+        self.remote_conns.clear()
         
         # Print session statistics
-        if self.stats['connection_start'] > 0:
-            session_duration = time.time() - self.stats['connection_start']
+        if self.connection_start > 0:
+            session_duration = time.time() - self.connection_start
             print(f"[CLIENT] Session duration: {session_duration:.1f}s")
-            print(f"[CLIENT] Packets sent: {self.stats['packets_sent']}")
-            print(f"[CLIENT] Packets received: {self.stats['packets_received']}")
-            print(f"[CLIENT] Data sent: {self.stats['bytes_sent']} bytes")
-            print(f"[CLIENT] Data received: {self.stats['bytes_received']} bytes")
+            print(f"[CLIENT] Packets sent: {self.packets_sent}")
+            print(f"[CLIENT] Packets received: {self.packets_received}")
+            print(f"[CLIENT] Data sent: {self.bytes_sent} bytes")
+            print(f"[CLIENT] Data received: {self.bytes_received} bytes")
     
     def send_data(self, data: str) -> tuple:
         """
         Send encrypted data through VPN tunnel
         
+        Replies are a JSON header, optionally followed by a newline and a
+        raw binary body (forwarded responses).
+        
         Args:
-            data: Data to send
+            data: Data to send (str or bytes)
             
         Returns:
-            Tuple of (success: bool, response: dict or error message, rtt: float)
+            Tuple of (success: bool, response: dict or error message,
+            body: bytes, rtt: float)
         """
         if not self.connected or not self.socket:
-            return False, "Not connected to VPN", 0
+            return False, "Not connected to VPN", b'', 0
         
         try:
-            start_time = time.time()
-            
-            # Encrypt and send with length prefix
-            encrypted_data = self.encryption.encrypt_aes(data, self.aes_key)
-            data_len = len(encrypted_data)
-            self.socket.sendall(data_len.to_bytes(4, 'big'))
-            self.socket.sendall(encrypted_data)
-            
-            self.stats['bytes_sent'] += len(encrypted_data)
-            self.stats['packets_sent'] += 1
-            
-            # Receive acknowledgment with length prefix
-            ack_len_bytes = b''
-            while len(ack_len_bytes) < 4:
-                chunk = self.socket.recv(4 - len(ack_len_bytes))
-                if not chunk:
-                    return False, "Connection closed during response length receive", 0
-                ack_len_bytes += chunk
-            
-            if len(ack_len_bytes) != 4:
-                return False, "Failed to receive response length", 0
-            ack_len = int.from_bytes(ack_len_bytes, 'big')
-            
-            # Receive all acknowledgment data
-            encrypted_ack = b''
-            while len(encrypted_ack) < ack_len:
-                chunk = self.socket.recv(min(ack_len - len(encrypted_ack), 4096))
-                if not chunk:
-                    return False, "Connection closed during response", 0
-                encrypted_ack += chunk
-            
-            ack = json.loads(self.encryption.decrypt_aes(encrypted_ack, self.aes_key))
+            # The tunnel is a single TCP stream: hold the lock for the whole
+            # request/response exchange so concurrent callers never interleave frames
+            with self.tunnel_lock:
+                start_time = time.time()
+                self._send_frame(data)
+                
+                header, _, body = self._recv_frame().partition(b'\n')
+                ack = _parse_reply_header(header)
+                
+                # Calculate RTT
+                rtt = time.time() - start_time
+                self.last_rtt = rtt
+                
+                return True, ack, body, rtt
+        except Exception as e:
+            return False, str(e), b'', 0
+    
+    def stream_data(self, data):
+        """
+        Send data through VPN tunnel and yield the reply as it arrives
+        
+        A reply whose header has "stream" set carries its body across
+        further frames, ending with an empty frame. Bodies up to
+        STREAM_BUFFER_SIZE are read in full before anything is yielded, so
+        the tunnel is free again while the caller writes them out. A longer
+        body is yielded as it arrives and the tunnel stays locked until the
+        generator finishes or is closed: a slow consumer then holds up
+        every other request on the tunnel.
+        
+        Args:
+            data: Data to send (str or bytes)
             
-            self.stats['bytes_received'] += len(encrypted_ack)
-            self.stats['packets_received'] += 1
+        Yields:
+            The reply header dict, then body chunks as bytes
+        """
+        if not self.connected or not self.socket:
+            raise ConnectionError("Not connected to VPN")
+        
+        chunks = []
+        with self.tunnel_lock:
+            start_time = time.time()
+            self._send_frame(data)
             
-            # Calculate RTT
-            rtt = time.time() - start_time
-            self.stats['last_rtt'] = rtt
+            header, _, body = self._recv_frame().partition(b'\n')
+            header = _parse_reply_header(header)
+            self.last_rtt = time.time() - start_time
+            if body:
+                chunks.append(body)
             
-            return True, ack, rtt
-        except Exception as e:
-            return False, str(e), 0
+            if header.get('stream'):
+                buffered = len(body)
+                complete = False
+                while buffered < STREAM_BUFFER_SIZE:
+                    chunk = self._recv_frame()
+                    if not chunk:
+                        complete = True
+                        break
+                    chunks.append(chunk)
+                    buffered += len(chunk)
+                
+                if not complete:
+                    # Too large to buffer: pass it on with the tunnel locked
+                    pending = True
+                    try:
+                        yield header
+                        yield from chunks
+                        for chunk in iter(self._recv_frame, b''):
+                            yield chunk
+                        pending = False
+                    finally:
+                        if pending:
+                            # Stopped early: drain the rest so the tunnel stays in step
+                            for _ in iter(self._recv_frame, b''):
+                                pass
+                    return
+        
+        yield header
+        yield from chunks
+    
+    def _send_frame(self, data):
+        """Encrypt and send one length-prefixed frame (tunnel_lock held)"""
+        # Length prefix and payload go out as a single write, so
+        # TCP_NODELAY doesn't push the 4-byte header out on its own
+        frame = self.cipher.seal_frame(data)
+        self.socket.sendall(frame)
+        
+        self.bytes_sent += len(frame) - 4
+        self.packets_sent += 1
+    
+    def _recv_frame(self) -> bytes:
+        """Receive and decrypt one length-prefixed frame (tunnel_lock held)"""
+        frame_len = LENGTH_PREFIX.unpack(self._recv_exact(4))[0]
+        encrypted_frame = self._recv_exact(frame_len)
+        
+        self.bytes_received += len(encrypted_frame)
+        self.packets_received += 1
+        return self.cipher.decrypt(encrypted_frame)
+    
+    def _recv_exact(self, n: int) -> bytes:
+        """Receive exactly n bytes from the tunnel socket"""
+        return recv_exact(self.socket, n)
     
-    def forward_traffic(self, dest_host: str, dest_port: int, data: str = "") -> tuple:
+    def forward_traffic(self, dest_host: str, dest_port: int, data: bytes = b"") -> tuple:
         """
         Forward traffic through VPN tunnel to destination
         
         Args:
             dest_host: Destination hostname/IP
             dest_port: Destination port
-            data: Optional data to send
+            data: Optional raw bytes to send
             
         Returns:
-            Tuple of (success: bool, response: dict or error message)
+            Tuple of (success: bool, response body bytes or error message)
         """
         if not self.connected:
             return False, "Not connected to VPN"
         
         try:
-            # Send forward request
-            forward_request = f"FORWARD:{dest_host}:{dest_port}:{data}"
-            success, response, rtt = self.send_data(forward_request)
-            
-            if success and isinstance(response, dict):
-                if response.get('status') == 'success':
-                    print(f"[CLIENT] ✓ Traffic forwarded to {dest_host}:{dest_port} (RTT: {rtt*1000:.2f}ms)")
-                    return True, response
-                else:
-                    error = response.get('error', 'Unknown error')
-                    print(f"[CLIENT] ✗ Forward failed: {error}")
-                    return False, error
-            else:
-                return False, str(response)
+            return True, b''.join(self.forward_stream(dest_host, dest_port, data))
         except Exception as e:
             return False, str(e)
     
+    def forward_stream(self, dest_host: str, dest_port: int, data: bytes = b""):
+        """
+        Forward traffic to destination and yield the response as it arrives
+        
+        Args:
+            dest_host: Destination hostname/IP
+            dest_port: Destination port
+            data: Optional raw bytes to send
+            
+        Yields:
+            Response chunks as bytes
+            
+        Raises:
+            ConnectionError: If the request could not be forwarded
+        """
+        # Send over a persistent connection to the destination
+        if isinstance(data, str):
+            data = data.encode()
+        conn_id = self._get_remote_conn(dest_host, dest_port)
+        
+        with closing(self.stream_data(pack_connection(CMD_SEND, conn_id, data))) as stream:
+            response = next(stream)
+            if response.get('status') != 'success':
+                # Let the next request open a fresh connection
+                with self.conns_lock:
+                    if self.remote_conns.get((dest_host, dest_port)) == conn_id:
+                        del self.remote_conns[(dest_host, dest_port)]
+                error = response.get('error', 'Unknown error')
+                print(f"[CLIENT] ✗ Forward failed: {error}")
+                raise ConnectionError(error)
+            
+            print(f"[CLIENT] ✓ Traffic forwarded to {dest_host}:{dest_port} (RTT: {self.last_rtt*1000:.2f}ms)")
+            yield from stream
+    
+    def _get_remote_conn(self, dest_host: str, dest_port: int) -> int:
+        """
+        Get the server-side connection id for a destination
+        
+        Reuses an open connection when there is one, so repeated requests
+        skip the destination TCP handshake; otherwise asks the server to
+        OPEN one. The least recently used connection is closed once more
+        than MAX_REMOTE_CONNS are open.
+        """
+        key = (dest_host, dest_port)
+        with self.conns_lock:
+            conn_id = self.remote_conns.get(key)
+            if conn_id is not None:
+                self.remote_conns.move_to_end(key)
+                return conn_id
+        
+        success, response, _, _ = self.send_data(pack_address(CMD_OPEN, dest_host, dest_port))
+        if not success or not isinstance(response, dict) or response.get('status') != 'success':
+            error = response.get('error', 'Unknown error') if isinstance(response, dict) else response
+            raise ConnectionError(f"Could not open {dest_host}:{dest_port}: {error}")
+        conn_id = response['conn_id']
+        
+        unused = None
+        with self.conns_lock:
+            existing = self.remote_conns.get(key)
+            if existing is not None:
+                # Another request opened one meanwhile; keep that and drop ours
+                unused, conn_id = conn_id, existing
+            else:
+                self.remote_conns[key] = conn_id
+                if len(self.remote_conns) > MAX_REMOTE_CONNS:
+                    _, unused = self.remote_conns.popitem(last=False)
+        
+        if unused is not None:
+            self.send_data(pack_connection(CMD_CLOSE, unused))
+        return conn_id
+    
     def request_statistics(self) -> dict:
         """Request server statistics"""
         if not self.connected:
             return {}
         
         try:
-            success, response, rtt = self.send_data("STATS_REQ")
+            success, response, _, rtt = self.send_data(bytes((CMD_STATS,)))
             if success and isinstance(response, dict):
                 return response
             return {}
         except:
             return {}
     
-    def _start_keepalive(self):
-        """Start keepalive thread"""
-        self.keepalive_running = True
-        self.keepalive_thread = threading.Thread(target=self._keepalive_loop, daemon=True)
-        self.keepalive_thread.start()
-    
-    def _stop_keepalive(self):
-        """Stop keepalive thread"""
-        self.keepalive_running = False
-        if self.keepalive_thread:
-            self.keepalive_thread.join(timeout=2.0)
-    
-    def _keepalive_loop(self):
-        """Send periodic keepalive packets"""
-        while self.keepalive_running and self.connected:
-            try:
-                time.sleep(config.KEEPALIVE_INTERVAL)
-                
-                if self.connected:
-                    keepalive_data = json.dumps({
-                        'type': 'keepalive',
-                        'timestamp': time.time()
-                    })
-                    self.send_data(keepalive_data)
-                    print("[CLIENT] ♥ Keepalive sent")
-            except:
-                pass
-    
     def set_server(self, host: str, port: int = None):
         """Set server connection details"""
         self.server_host = host
@@ -324,7 +457,14 @@ class VPNClientEnhanced:
     
     def get_stats(self) -> dict:
         """Get client statistics"""
-        stats = self.stats.copy()
-        if stats['connection_start'] > 0:
-            stats['uptime'] = time.time() - stats['connection_start']
+        stats = {
+            'bytes_sent': self.bytes_sent,
+            'bytes_received': self.bytes_received,
+            'packets_sent': self.packets_sent,
+            'packets_received': self.packets_received,
+            'connection_start': self.connection_start,
+            'last_rtt': self.last_rtt
+        }
+        if self.connection_start > 0:
+            stats['uptime'] = time.time() - self.connection_start
         return stats
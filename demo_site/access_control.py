@@ -4,12 +4,30 @@ Manages IP-based and file-based access control
 """
 
 import os
+import threading
+from ipaddress import ip_address
 from . import config
 
+try:
+    from watchdog.observers import Observer
+    from watchdog.events import FileSystemEventHandler
+except ImportError:  # Optional - fall back to an mtime check per request
+    Observer = None
+
 
 class AccessControl:
     """Handles access control for demo site"""
     
+    # Cached contents of the access control file, kept current by a
+    # watchdog observer (or re-read when the file's mtime changes)
+    _vpn_status = None
+    _vpn_mtime = None
+    # Bumped whenever the cached status changes, so callers caching
+    # is_allowed() results know to drop them
+    status_version = 0
+    _watcher = None
+    _watcher_lock = threading.Lock()
+    
     @staticmethod
     def is_allowed(client_ip: str) -> tuple:
         """
@@ -26,6 +44,16 @@ class AccessControl:
             # First check if explicitly blocked
             if client_ip in config.BLOCKED_IPS:
                 return False, f"IP {client_ip} is blocked (geo-restricted)"
+            if config.BLOCKED_NETS:
+                try:
+                    address = ip_address(client_ip)
+                except ValueError:
+                    address = None
+                if address is not None and any(
+                    address.version == version and (int(address) >> host_bits) in prefixes
+                    for version, host_bits, prefixes in config.BLOCKED_NETS
+                ):
+                    return False, f"IP {client_ip} is blocked (geo-restricted)"
             
             # Then check if in allowed list (VPN server IP or localhost)
             if hasattr(config, 'ALLOWED_IPS'):
@@ -42,14 +70,70 @@ class AccessControl:
     
     @staticmethod
     def _check_vpn_file() -> str:
-        """Check VPN access control file"""
+        """
+        Check VPN access control file
+        
+        Served from memory: a watchdog observer refreshes the cached status
+        when the file changes. Without watchdog, the file is only re-read
+        when its mtime changes (one stat per request instead of open/read).
+        """
+        if AccessControl._watcher is None:
+            AccessControl._start_watcher()
+        
+        if AccessControl._watcher and AccessControl._vpn_status is not None:
+            return AccessControl._vpn_status
+        
         try:
-            if os.path.exists(config.ACCESS_CONTROL_FILE):
-                with open(config.ACCESS_CONTROL_FILE, 'r') as f:
-                    return f.read().strip().lower()
+            mtime = os.stat(config.ACCESS_CONTROL_FILE).st_mtime_ns
+        except OSError:
+            return 'blocked'
+        if mtime != AccessControl._vpn_mtime or AccessControl._vpn_status is None:
+            AccessControl._vpn_mtime = mtime
+            AccessControl._reload_vpn_file()
+        return AccessControl._vpn_status
+    
+    @staticmethod
+    def _reload_vpn_file():
+        """Re-read the access control file into the cached status"""
+        try:
+            with open(config.ACCESS_CONTROL_FILE, 'r') as f:
+                status = f.read().strip().lower()
         except:
-            pass
-        return 'blocked'
+            status = 'blocked'
+        if status != AccessControl._vpn_status:
+            AccessControl._vpn_status = status
+            AccessControl.status_version += 1
+    
+    @staticmethod
+    def _start_watcher():
+        """Start watching the access control file's directory (once)"""
+        with AccessControl._watcher_lock:
+            if AccessControl._watcher is not None:
+                return
+            if Observer is None:
+                AccessControl._watcher = False
+                return
+            
+            path = os.path.abspath(config.ACCESS_CONTROL_FILE)
+            
+            class _Handler(FileSystemEventHandler):
+                def on_any_event(self, event):
+                    paths = (getattr(event, 'src_path', None), getattr(event, 'dest_path', None))
+                    if path in paths:
+                        AccessControl._reload_vpn_file()
+            
+            try:
+                observer = Observer()
+                observer.daemon = True
+                observer.schedule(_Handler(), os.path.dirname(path))
+                observer.start()
+            except Exception as e:
+                print(f"[ACCESS] File watcher unavailable ({e}), checking mtime instead")
+                AccessControl._watcher = False
+                return
+            
+            AccessControl._reload_vpn_file()
+            AccessControl._watcher = observer
     
     @staticmethod
     def initialize_access_file():
@@ -59,3 +143,4 @@ class AccessControl:
                 f.write('blocked')
         except:
             pass
+        AccessControl.status_version += 1
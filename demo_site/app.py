@@ -3,31 +3,64 @@ Demo Website Application
 Flask app that simulates geo-restricted content
 """
 
-import sys
 import os
-from flask import Flask, render_template, request, abort
+from flask import Flask, Response, render_template, request, abort
 import time
 
-# Add parent directory to path
-sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+try:
+    from gunicorn.app.base import BaseApplication
+except ImportError:  # Optional production server - fall back to the Flask dev server
+    BaseApplication = None
+
+try:
+    import gevent
+except ImportError:  # Optional greenlet workers - gunicorn uses threads instead
+    gevent = None
 
 from demo_site import config
 from demo_site.access_control import AccessControl
 
-app = Flask(__name__, template_folder='../templates')
+# Templates ship inside the package (demo_site/templates)
+app = Flask(__name__)
 access_control = AccessControl()
 
+# Recent access decisions: client IP -> (expires_at, status_version, allowed)
+ACCESS_CACHE_TTL = 1.0
+ACCESS_CACHE_MAX = 4096
+_access_cache = {}
+
+# /status payload pre-encoded around its only variable field, client_ip
+# (an IP address, so it never needs JSON escaping)
+STATUS_PREFIX = b'{"status": "online", "message": "Accessed through VPN!", "vpn_status": "connected", "client_ip": "'
+STATUS_SUFFIX = b'"}'
+
 
 @app.before_request
 def check_access():
     """Check if client should have access before serving any page"""
+    # Static assets (CSS/JS/images) are not geo-restricted content; only the
+    # pages that reference them are checked
+    if request.endpoint == 'static':
+        return
+    
     client_ip = request.remote_addr
     
-    allowed, reason = access_control.is_allowed(client_ip)
+    # Repeat clients reuse the decision for up to ACCESS_CACHE_TTL seconds,
+    # or until the access file status changes
+    now = time.monotonic()
+    version = AccessControl.status_version
+    cached = _access_cache.get(client_ip)
+    if cached and cached[0] > now and cached[1] == version:
+        allowed = cached[2]
+    else:
+        allowed, reason = access_control.is_allowed(client_ip)
+        if len(_access_cache) >= ACCESS_CACHE_MAX:
+            _access_cache.clear()
+        _access_cache[client_ip] = (now + ACCESS_CACHE_TTL, version, allowed)
     
     if not allowed:
-        # Simulate connection refused/timeout
-        time.sleep(0.5)
+        # Refuse straight away: sleeping here would hold a worker thread
+        # per blocked request, letting a flood starve legitimate clients
         abort(503)
 
 
@@ -41,12 +74,8 @@ def index():
 @app.route('/status')
 def status():
     """Status endpoint"""
-    return {
-        'status': 'online',
-        'message': 'Accessed through VPN!',
-        'client_ip': request.remote_addr,
-        'vpn_status': 'connected'
-    }
+    client_ip = (request.remote_addr or '').encode('ascii')
+    return Response(STATUS_PREFIX + client_ip + STATUS_SUFFIX, mimetype='application/json')
 
 
 @app.errorhandler(503)
@@ -55,6 +84,27 @@ def service_unavailable(e):
     return "", 503
 
 
+def _run_gunicorn():
+    """
+    Serve the app with gunicorn: one worker per CPU, gevent greenlets
+    when available (threaded workers otherwise)
+    """
+    class DemoSiteServer(BaseApplication):
+        def load_config(self):
+            self.cfg.set('bind', f"{config.HOST}:{config.PORT}")
+            self.cfg.set('workers', os.cpu_count() or 1)
+            if gevent:
+                self.cfg.set('worker_class', 'gevent')
+            else:
+                self.cfg.set('worker_class', 'gthread')
+                self.cfg.set('threads', 8)
+        
+        def load(self):
+            return app
+    
+    DemoSiteServer().run()
+
+
 def main():
     """Main entry point for demo website"""
     print("=" * 70)
@@ -69,7 +119,7 @@ def main():
         print("  • Initial state: BLOCKED")
     if config.USE_IP_BLOCKING:
         print(f"  • IP blocking: ENABLED")
-        print(f"  • Blocked IPs: {config.BLOCKED_IPS}")
+        print(f"  • Blocked IPs: {sorted(config.BLOCKED_IPS)}")
     print()
     print("Demo Flow:")
     print("  1. Try http://localhost:9000 → Error (blocked)")
@@ -78,7 +128,12 @@ def main():
     print("=" * 70)
     print()
     
-    app.run(host=config.HOST, port=config.PORT, debug=False, threaded=True)
+    if BaseApplication:
+        print(f"Serving with gunicorn ({'gevent' if gevent else 'gthread'} workers)")
+        _run_gunicorn()
+    else:
+        # Werkzeug development server
+        app.run(host=config.HOST, port=config.PORT, debug=False, threaded=True)
 
 
 if __name__ == '__main__':
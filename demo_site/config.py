@@ -2,6 +2,8 @@
 Demo Website Configuration
 """
 
+from ipaddress import ip_network
+
 # Server Settings
 HOST = '0.0.0.0'  # Bind to all interfaces for two-device setup
 PORT = 9000
@@ -11,8 +13,31 @@ ACCESS_CONTROL_FILE = 'vpn_access.txt'
 
 # IP-based blocking (for two-device setup)
 USE_IP_BLOCKING = True
-BLOCKED_IPS = ['192.168.0.130']  # VM2 (Client) IP - blocked from direct access
-ALLOWED_IPS = ['127.0.0.1', '::1', '192.168.0.105']  # VM1 (Server) IP - allowed
+# Checked on every request, so kept as frozensets (hash lookups, not list scans)
+BLOCKED_IPS = frozenset({'192.168.0.130'})  # VM2 (Client) IP - blocked from direct access
+ALLOWED_IPS = frozenset({'127.0.0.1', '::1', '192.168.0.105'})  # VM1 (Server) IP - allowed
+BLOCKED_CIDRS = []  # Whole ranges to block, e.g. '192.168.0.128/25'
+
+
+def _index_networks(cidrs: list) -> list:
+    """
+    Index CIDR blocks by prefix length for hashed matching
+    
+    Returns:
+        List of (ip_version, host_bits, frozenset of network prefixes); an
+        address matches when (int(address) >> host_bits) is in the set
+    """
+    index = {}
+    for cidr in cidrs:
+        net = ip_network(cidr)
+        key = (net.version, net.max_prefixlen - net.prefixlen)
+        index.setdefault(key, set()).add(int(net.network_address) >> key[1])
+    return [(version, host_bits, frozenset(prefixes))
+            for (version, host_bits), prefixes in index.items()]
+
+
+# One set lookup per distinct prefix length, however many blocks are listed
+BLOCKED_NETS = _index_networks(BLOCKED_CIDRS)
 
 # File-based access control (for single-device demo)
 USE_FILE_BASED_CONTROL = False  # Disabled for 2-VM setup
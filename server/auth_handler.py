@@ -3,11 +3,39 @@ Authentication Handler
 Handles user authentication and credential validation
 """
 
+import hashlib
+import hmac
 import json
 import time
-from typing import Tuple
+from functools import lru_cache
+from typing import List, Tuple, Union
+from shared.commands import unpack_auth
 from . import config
 
+try:
+    import orjson
+except ImportError:  # Optional C JSON codec - fall back to the stdlib
+    orjson = None
+
+
+@lru_cache(maxsize=64)
+def _encode_auth_response(success: bool, message: str, info_items: tuple) -> bytes:
+    """
+    Serialize an auth response, memoized per distinct response
+    
+    The server sends the same few responses over and over, so each is
+    encoded once. Tuples in info_items encode as JSON arrays.
+    """
+    response = {
+        'status': 'success' if success else 'error',
+        'message': message
+    }
+    response.update(info_items)
+    
+    if orjson:
+        return orjson.dumps(response)
+    return json.dumps(response).encode()
+
 
 class AuthHandler:
     """Manages authentication for VPN connections"""
@@ -24,32 +52,55 @@ class AuthHandler:
         Returns:
             bool: True if credentials are valid
         """
-        if username in config.VALID_CREDENTIALS:
-            return config.VALID_CREDENTIALS[username] == password
-        return False
+        # Hash even for unknown users so timing doesn't reveal valid names
+        digest = hashlib.blake2b(str(password).encode(), key=config.CREDENTIAL_HASH_KEY).digest()
+        expected = config.VALID_CREDENTIALS.get(username)
+        if expected is None:
+            return False
+        return hmac.compare_digest(expected, digest)
     
     @staticmethod
-    def parse_auth_data(auth_json: str) -> Tuple[str, str, float]:
+    def parse_auth_data(auth_json: Union[str, bytes]) -> Tuple[str, str, float]:
         """
-        Parse authentication JSON data
+        Parse authentication data
         
         Args:
-            auth_json: JSON string containing auth data
+            auth_json: Binary credentials (shared.commands.pack_auth), or a
+                JSON string / UTF-8 bytes from older clients
             
         Returns:
             Tuple of (username, password, timestamp)
         """
+        return AuthHandler.parse_auth_request(auth_json)[:3]
+    
+    @staticmethod
+    def parse_auth_request(auth_data: Union[str, bytes]) -> Tuple[str, str, float, List[str]]:
+        """
+        Parse authentication data including the offered cipher suites
+        
+        Args:
+            auth_data: Binary credentials (shared.commands.pack_auth), or a
+                JSON string / UTF-8 bytes from older clients
+            
+        Returns:
+            Tuple of (username, password, timestamp, cipher_suites), with
+            cipher_suites empty if the client offered none
+        """
         try:
-            data = json.loads(auth_json)
+            if isinstance(auth_data, bytes) and not auth_data.startswith(b'{'):
+                return unpack_auth(auth_data)
+            
+            data = orjson.loads(auth_data) if orjson else json.loads(auth_data)
             username = data.get('username', '')
             password = data.get('password', '')
             timestamp = data.get('timestamp', time.time())
-            return username, password, timestamp
+            suites = data.get('cipher_suites', [])
+            return username, password, timestamp, suites if isinstance(suites, list) else []
         except Exception:
-            return '', '', 0.0
+            return '', '', 0.0, []
     
     @staticmethod
-    def create_auth_response(success: bool, message: str, server_info: dict = None) -> str:
+    def create_auth_response(success: bool, message: str, server_info: dict = None) -> bytes:
         """
         Create authentication response JSON
         
@@ -59,14 +110,14 @@ class AuthHandler:
             server_info: Additional server information
             
         Returns:
-            str: JSON response string
+            bytes: UTF-8 JSON response
         """
-        response = {
-            'status': 'success' if success else 'error',
-            'message': message
-        }
-        
-        if server_info:
-            response.update(server_info)
-            
-        return json.dumps(response)
+        # Lists (e.g. 'features') become tuples so the key is hashable
+        info_items = tuple(sorted(
+            (key, tuple(value) if isinstance(value, list) else value)
+            for key, value in (server_info or {}).items()
+        ))
+        try:
+            return _encode_auth_response(bool(success), message, info_items)
+        except TypeError:  # Other unhashable values - encode without caching
+            return _encode_auth_response.__wrapped__(bool(success), message, info_items)
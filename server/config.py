@@ -2,16 +2,33 @@
 VPN Server Configuration
 """
 
+import hashlib
+import os
+
 # Server Network Settings
 HOST = '0.0.0.0'  # Bind to all interfaces
 PORT = 8888       # VPN server port
 
+# Kernel send/receive buffer for tunnel and destination sockets. Large
+# enough to keep a high bandwidth-delay-product link full with one stream.
+SOCKET_BUFFER_SIZE = 4 * 1024 * 1024
+
+# Unsent bytes the kernel queues per client socket before send() blocks
+# (Linux TCP_NOTSENT_LOWAT). Keeps a deep send buffer from piling up
+# latency for replies queued behind a bulk transfer.
+TCP_NOTSENT_LOWAT = 128 * 1024
+
 # Security Settings
 REQUIRE_AUTH = True
+SERVER_KEY_FILE = 'server_key.pem'  # RSA private key, created on first start
 MAX_CLIENTS = 10
+# Seconds a new connection has to complete the handshake before its
+# handler slot is reclaimed
+HANDSHAKE_TIMEOUT = 10.0
 
 # Logging
 VERBOSE_LOGGING = True
+STATS_REPORT_INTERVAL = 30.0  # Seconds between server statistics reports
 LOG_ENCRYPTION_DETAILS = False
 
 # Authentication Credentials
@@ -21,3 +38,10 @@ VALID_CREDENTIALS = {
     'admin': 'admin123',
     'demo': 'demo123'
 }
+
+# Passwords are kept only as keyed BLAKE2b digests (fresh key per process)
+CREDENTIAL_HASH_KEY = os.urandom(32)
+VALID_CREDENTIALS = {
+    username: hashlib.blake2b(password.encode(), key=CREDENTIAL_HASH_KEY).digest()
+    for username, password in VALID_CREDENTIALS.items()
+}
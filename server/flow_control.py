@@ -5,8 +5,61 @@ Implements congestion control and flow control mechanisms
 
 import time
 import threading
+from array import array
 from collections import deque
 
+# Unfolded sends allowed to pile up before a sender folds them itself
+PENDING_SENDS_LIMIT = 1024
+
+# ACKs buffered before they are applied to the window in one locked pass
+ACK_BATCH_SIZE = 64
+
+# RFC 6298 smoothing factors for SRTT and RTTVAR
+RTT_ALPHA = 0.125
+RTT_BETA = 0.25
+
+
+class _SampleRing:
+    """
+    Fixed-size ring buffer of float samples with a running sum
+    
+    Samples live unboxed in one preallocated array('d') (8 bytes each)
+    rather than as float objects in a deque; the mean is O(1).
+    """
+    
+    __slots__ = ('values', 'index', 'count', 'total')
+    
+    def __init__(self, size: int):
+        self.values = array('d', bytes(8 * size))
+        self.index = 0
+        self.count = 0
+        self.total = 0.0
+    
+    def append(self, sample: float):
+        """Add a sample, overwriting the oldest once the ring is full"""
+        values = self.values
+        index = self.index
+        if self.count == len(values):
+            self.total -= values[index]  # Evicted
+        else:
+            self.count += 1
+        values[index] = sample
+        self.total += sample
+        self.index = (index + 1) % len(values)
+    
+    def clear(self):
+        """Drop all samples, keeping the preallocated array"""
+        self.index = 0
+        self.count = 0
+        self.total = 0.0
+    
+    def mean(self) -> float:
+        """Average of the stored samples (0 when empty)"""
+        return self.total / self.count if self.count else 0
+    
+    def __len__(self) -> int:
+        return self.count
+
 
 class FlowController:
     """
@@ -16,19 +69,51 @@ class FlowController:
     
     def __init__(self, initial_window_size: int = 65536):
         # Sliding window parameters
-        self.window_size = initial_window_size  # bytes
+        self.initial_window_size = initial_window_size  # bytes
         self.max_window_size = 1048576  # 1 MB
         self.min_window_size = 4096     # 4 KB
+        # Limited Slow-Start (RFC 3742): above this, slow start grows by at
+        # most max_ssthresh / 2 per RTT instead of doubling
+        self.max_ssthresh = 100 * 1024  # 100 x 1 KB segments
+        
+        # Sample buffers, allocated once and cleared by reset()
+        self.rtt_samples = _SampleRing(10)
+        self.throughput_samples = _SampleRing(20)
+        
+        # Sent packet sizes not yet counted. Senders only append (atomic on
+        # a deque, no lock); readers fold them into the counters under the lock
+        self._pending_sends = deque()
+        # Likewise (packet_size, rtt) ACKs, applied in order in batches
+        self._pending_acks = deque()
+        
+        # Guards the counters and the cwnd/ssthresh state machine
+        self.lock = threading.Lock()
+        
+        self.reset()
+    
+    def reset(self):
+        """
+        Return to the state of a fresh connection
+        
+        Clears the existing buffers in place, so the server can hand a
+        pooled controller to the next tunnel instead of building a new one.
+        Only call while no tunnel is using the controller.
+        """
+        self.window_size = self.initial_window_size
         
         # Congestion control state
-        self.ssthresh = initial_window_size // 2  # Slow start threshold
+        self.ssthresh = self.initial_window_size // 2  # Slow start threshold
         self.cwnd = self.min_window_size          # Congestion window
         self.in_slow_start = True
+        # H-TCP: congestion avoidance speeds up with time since the last loss
+        self.last_congestion_ns = time.monotonic_ns()
         
         # RTT (Round Trip Time) measurement
-        self.rtt_samples = deque(maxlen=10)
+        self.rtt_samples.clear()
         self.smoothed_rtt = 0.0
         self.rtt_variance = 0.0
+        # Retransmission timeout, recomputed only when the RTT estimate changes
+        self.rto = 1.0  # Default 1 second until the first sample
         
         # Packet tracking
         self.packets_in_flight = 0
@@ -37,11 +122,13 @@ class FlowController:
         self.retransmissions = 0
         
         # Statistics
-        self.throughput_samples = deque(maxlen=20)
-        self.last_stat_time = time.time()
+        self.throughput_samples.clear()
+        # Monotonic integer clock: immune to wall-clock steps, no float per call
+        self.last_stat_ns = time.monotonic_ns()
         self.bytes_transferred = 0
         
-        self.lock = threading.Lock()
+        self._pending_sends.clear()
+        self._pending_acks.clear()
     
     def can_send(self, data_size: int) -> bool:
         """
@@ -54,51 +141,105 @@ class FlowController:
             bool: True if we can send
         """
         with self.lock:
+            self._fold_pending()
             # Check if within congestion window
             bytes_in_flight = self.packets_in_flight * 1024  # Approximate
             return (bytes_in_flight + data_size) <= self.cwnd
     
     def on_packet_sent(self, packet_size: int):
-        """Called when a packet is sent"""
-        with self.lock:
-            self.packets_in_flight += 1
-            self.total_packets_sent += 1
-            self.bytes_transferred += packet_size
+        """Called when a packet is sent (lock-free fast path)"""
+        self._pending_sends.append(packet_size)
+        if len(self._pending_sends) >= PENDING_SENDS_LIMIT:
+            with self.lock:
+                self._fold_pending()
+    
+    def _fold_pending(self):
+        """Apply logged sends, then logged ACKs, to the state (lock held)"""
+        pending = self._pending_sends
+        count = len(pending)
+        if count:
+            sent_bytes = 0
+            for _ in range(count):
+                sent_bytes += pending.popleft()
+            self.packets_in_flight += count
+            self.total_packets_sent += count
+            self.bytes_transferred += sent_bytes
+        
+        acks = self._pending_acks
+        count = len(acks)
+        if count:
+            # One increase factor per batch: it moves on a seconds scale
+            alpha = self._htcp_alpha()
+            for _ in range(count):
+                packet_size, rtt = acks.popleft()
+                self._apply_ack(packet_size, rtt, alpha)
+            
+            # Update throughput statistics
+            self._update_throughput()
     
     def on_ack_received(self, packet_size: int, rtt: float):
         """
         Called when acknowledgment is received
         Updates congestion window based on TCP-like algorithm
         
+        ACKs are buffered and applied ACK_BATCH_SIZE at a time under one
+        lock acquisition (or sooner, whenever the state is read), so a
+        burst of ACKs doesn't contend on the lock once per packet.
+        
         Args:
             packet_size: Size of acknowledged packet
             rtt: Round trip time in seconds
         """
-        with self.lock:
-            self.packets_in_flight -= 1
-            self.total_packets_acked += 1
-            
-            # Update RTT estimates
-            self._update_rtt(rtt)
-            
-            # Update congestion window (TCP Reno-like)
-            if self.in_slow_start:
+        self._pending_acks.append((packet_size, rtt))
+        if len(self._pending_acks) >= ACK_BATCH_SIZE:
+            with self.lock:
+                self._fold_pending()
+    
+    def _htcp_alpha(self) -> float:
+        """
+        H-TCP additive increase factor
+        
+        Reno-like (1) for the first second after a congestion event, then
+        1 + 10*(t-1) + ((t-1)/2)^2 so long-lived flows on high-BDP links
+        reclaim bandwidth quickly.
+        """
+        delta = (time.monotonic_ns() - self.last_congestion_ns) * 1e-9 - 1.0
+        if delta <= 0:
+            return 1.0
+        return 1.0 + 10.0 * delta + (delta / 2) ** 2
+    
+    def _apply_ack(self, packet_size: int, rtt: float, alpha: float = 1.0):
+        """Update counters, RTT and cwnd for one ACK (lock held)"""
+        self.packets_in_flight -= 1
+        self.total_packets_acked += 1
+        
+        # Update RTT estimates
+        self._update_rtt(rtt)
+        
+        # Update congestion window (TCP Reno-like) in a local and
+        # store it once
+        cwnd = self.cwnd
+        if self.in_slow_start:
+            if cwnd <= self.max_ssthresh:
                 # Slow start: exponential growth
-                self.cwnd += packet_size
-                
-                # Check if we should exit slow start
-                if self.cwnd >= self.ssthresh:
-                    self.in_slow_start = False
+                cwnd += packet_size
             else:
-                # Congestion avoidance: linear growth
-                increment = (packet_size * packet_size) // self.cwnd
-                self.cwnd += max(1, increment)
-            
-            # Cap at max window size
-            self.cwnd = min(self.cwnd, self.max_window_size)
+                # Limited slow start: K = cwnd / (max_ssthresh / 2)
+                k = cwnd // (self.max_ssthresh // 2)
+                cwnd += packet_size // k
             
-            # Update throughput statistics
-            self._update_throughput()
+            # Check if we should exit slow start
+            if cwnd >= self.ssthresh:
+                self.in_slow_start = False
+        else:
+            # Congestion avoidance: linear growth, scaled by H-TCP's alpha
+            increment = int(alpha * packet_size * packet_size / cwnd)
+            cwnd += increment if increment > 1 else 1
+        
+        # Cap at max window size
+        if cwnd > self.max_window_size:
+            cwnd = self.max_window_size
+        self.cwnd = cwnd
     
     def on_packet_loss(self):
         """
@@ -106,49 +247,56 @@ class FlowController:
         Implements congestion control response
         """
         with self.lock:
+            self._fold_pending()
             self.retransmissions += 1
             
             # Multiplicative decrease
             self.ssthresh = max(self.cwnd // 2, self.min_window_size)
             self.cwnd = self.ssthresh
             self.in_slow_start = False
+            self.last_congestion_ns = time.monotonic_ns()
     
     def on_timeout(self):
         """Called when timeout occurs"""
         with self.lock:
+            self._fold_pending()
             # Severe congestion indication
             self.ssthresh = max(self.cwnd // 2, self.min_window_size)
             self.cwnd = self.min_window_size
             self.in_slow_start = True
+            self.last_congestion_ns = time.monotonic_ns()
     
     def _update_rtt(self, rtt_sample: float):
         """Update RTT estimates using exponential moving average"""
         self.rtt_samples.append(rtt_sample)
         
-        if self.smoothed_rtt == 0:
+        srtt = self.smoothed_rtt
+        if srtt == 0:
             # First sample
             self.smoothed_rtt = rtt_sample
             self.rtt_variance = rtt_sample / 2
         else:
             # Exponential moving average
-            alpha = 0.125  # Smoothing factor
-            beta = 0.25
-            
-            error = rtt_sample - self.smoothed_rtt
-            self.smoothed_rtt += alpha * error
-            self.rtt_variance += beta * (abs(error) - self.rtt_variance)
+            error = rtt_sample - srtt
+            self.smoothed_rtt = srtt + RTT_ALPHA * error
+            rttvar = self.rtt_variance
+            self.rtt_variance = rttvar + RTT_BETA * (abs(error) - rttvar)
+        
+        # RTO = SRTT + 4 * RTTVAR (as per RFC 6298), clamped between 200ms and 60s
+        rto = self.smoothed_rtt + 4 * self.rtt_variance
+        self.rto = 0.2 if rto < 0.2 else (60.0 if rto > 60.0 else rto)
     
     def _update_throughput(self):
         """Calculate current throughput"""
-        current_time = time.time()
-        time_delta = current_time - self.last_stat_time
+        now_ns = time.monotonic_ns()
+        elapsed_ns = now_ns - self.last_stat_ns
         
-        if time_delta >= 1.0:  # Update every second
-            throughput = self.bytes_transferred / time_delta  # bytes/sec
+        if elapsed_ns >= 1_000_000_000:  # Update every second
+            throughput = self.bytes_transferred / (elapsed_ns * 1e-9)  # bytes/sec
             self.throughput_samples.append(throughput)
             
             self.bytes_transferred = 0
-            self.last_stat_time = current_time
+            self.last_stat_ns = now_ns
     
     def get_timeout(self) -> float:
         """
@@ -157,24 +305,19 @@ class FlowController:
         Returns:
             float: Timeout in seconds
         """
-        with self.lock:
-            if self.smoothed_rtt == 0:
-                return 1.0  # Default 1 second
-            
-            # RTO = SRTT + 4 * RTTVAR (as per RFC 6298)
-            rto = self.smoothed_rtt + 4 * self.rtt_variance
-            return max(0.2, min(rto, 60.0))  # Clamp between 200ms and 60s
+        # The RTO is kept current by _update_rtt, so this is a plain
+        # attribute read unless buffered ACKs still have to be applied
+        if self._pending_acks:
+            with self.lock:
+                self._fold_pending()
+        return self.rto
     
     def get_stats(self) -> dict:
         """Get flow control statistics"""
         with self.lock:
-            avg_throughput = 0
-            if self.throughput_samples:
-                avg_throughput = sum(self.throughput_samples) / len(self.throughput_samples)
-            
-            avg_rtt = 0
-            if self.rtt_samples:
-                avg_rtt = sum(self.rtt_samples) / len(self.rtt_samples)
+            self._fold_pending()
+            avg_throughput = self.throughput_samples.mean()
+            avg_rtt = self.rtt_samples.mean()
             
             return {
                 'congestion_window': self.cwnd,
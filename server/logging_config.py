@@ -0,0 +1,37 @@
+"""
+Server Logging Setup
+Routes log records through a queue so connection threads never block on stdout
+"""
+
+import logging
+import queue
+from logging.handlers import QueueHandler, QueueListener
+
+
+def start_queue_logging(level: int = logging.INFO) -> QueueListener:
+    """
+    Send all logging through a background listener thread
+    
+    Handler threads only enqueue records (O(1), no stdout lock); the
+    listener formats and writes them.
+    
+    Args:
+        level: Root logger level
+    
+    Returns:
+        QueueListener: Started listener; call stop() on shutdown to flush
+    """
+    log_queue = queue.SimpleQueue()
+    
+    stream_handler = logging.StreamHandler()
+    stream_handler.setFormatter(logging.Formatter(
+        '[%(asctime)s] [%(levelname)s] %(message)s', datefmt='%H:%M:%S'
+    ))
+    
+    root = logging.getLogger()
+    root.handlers[:] = [QueueHandler(log_queue)]
+    root.setLevel(level)
+    
+    listener = QueueListener(log_queue, stream_handler)
+    listener.start()
+    return listener
@@ -4,13 +4,10 @@ Run this file to start the VPN server
 """
 
 import sys
-import os
-
-# Add parent directory to path
-sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
 
 from server.vpn_server_core import VPNServer
 from server import config
+from server.logging_config import start_queue_logging
 
 
 def main():
@@ -24,6 +21,8 @@ def main():
     print("=" * 70)
     print()
     
+    # Connection threads log through a queue; one listener thread writes
+    log_listener = start_queue_logging()
     server = VPNServer(config.HOST, config.PORT)
     
     try:
@@ -37,6 +36,8 @@ def main():
     except Exception as e:
         print(f"\n❌ Server error: {e}")
         sys.exit(1)
+    finally:
+        log_listener.stop()
 
 
 if __name__ == '__main__':
@@ -2,15 +2,22 @@
 VPN Server Entry Point - Enhanced Version with signal handling
 """
 
-import sys
 import os
+
+# Keep any native thread pools single-threaded: the server already runs
+# one thread per client, so nested parallelism would only oversubscribe
+# the CPUs. Set before anything imports a library that reads them.
+os.environ.setdefault('NUMBA_NUM_THREADS', '1')
+os.environ.setdefault('OMP_NUM_THREADS', '1')
+os.environ.setdefault('MKL_NUM_THREADS', '1')
+
+import sys
 import signal
 import time
 
-sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
-
 from server.vpn_server_enhanced import VPNServerEnhanced
 from server import config
+from server.logging_config import start_queue_logging
 
 server_instance = None
 
@@ -53,6 +60,9 @@ def main():
     print("=" * 70)
     print()
     
+    # Connection threads log through a queue; one listener thread writes
+    log_listener = start_queue_logging()
+    
     try:
         server_instance = VPNServerEnhanced(config.HOST, config.PORT)
         server_instance.start()
@@ -69,6 +79,8 @@ def main():
         print(f"[SERVER] Error: {e}")
         if server_instance:
             server_instance.shutdown()
+    finally:
+        log_listener.stop()  # Flush queued log records (also runs on sys.exit)
 
 
 if __name__ == '__main__':
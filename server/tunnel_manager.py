@@ -5,17 +5,46 @@ Handles actual packet forwarding and traffic routing through VPN
 
 import socket
 import threading
-import select
+from array import array
 import time
 import json
+import logging
 from typing import Optional
 import sys
 import os
 
 sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
 
-from shared.encryption import EncryptionHandler
-from shared.constants import DEFAULT_BUFFER_SIZE
+from shared.encryption import TunnelCipher, CIPHER_AES_GCM
+from shared.framing import RECV_WAITALL, LENGTH_PREFIX
+from shared.commands import unpack_address, unpack_connection
+from . import config
+from shared.constants import FORWARD_OK_HEADER, STREAM_OK_HEADER, KEEPALIVE_ACK
+
+logger = logging.getLogger('vpn_server.tunnel')
+
+# Initial size of the per-tunnel receive buffer; grown on demand up to
+# MAX_REQUEST_SIZE so idle tunnels don't each pin megabytes
+RX_BUFFER_SIZE = 65536
+MAX_REQUEST_SIZE = 10 * 1024 * 1024
+
+# Pooled FORWARD destination connections idle longer than this are closed
+DEST_IDLE_TIMEOUT = 30.0
+
+# Destination reads: large enough that a response body crosses the
+# tunnel in a few big frames rather than many 4 KB ones
+RELAY_RECV_SIZE = 65536
+
+# Tunnel counters: fixed slots in one array instead of a dict
+STAT_FIELDS = ('bytes_sent', 'bytes_received', 'packets_sent', 'packets_received', 'connections')
+STAT_BYTES_SENT, STAT_BYTES_RECEIVED, STAT_PACKETS_SENT, STAT_PACKETS_RECEIVED, STAT_CONNECTIONS = range(5)
+
+# STATS_REQ reply: the five counters (in STAT_FIELDS order) formatted
+# straight into bytes, same layout json.dumps of the stats dict produced
+STATS_TEMPLATE = (
+    b'{"bytes_sent": %d, "bytes_received": %d, "packets_sent": %d, '
+    b'"packets_received": %d, "connections": %d}'
+)
 
 
 class TunnelManager:
@@ -24,316 +53,636 @@ class TunnelManager:
     Implements actual packet forwarding and routing
     """
     
-    def __init__(self, aes_key: bytes, client_socket: socket.socket):
+    def __init__(self, aes_key: bytes, client_socket: socket.socket, cipher_suite: str = CIPHER_AES_GCM):
         self.aes_key = aes_key
         self.client_socket = client_socket
-        self.encryption = EncryptionHandler()
+        # Long-lived per-direction cipher contexts for framed tunnel traffic
+        self.cipher = TunnelCipher(aes_key, is_client=False, cipher_suite=cipher_suite)
+        # Reused for every request frame: length prefix, then ciphertext
+        self._rx_buf = bytearray(RX_BUFFER_SIZE)
+        self._rx_view = memoryview(self._rx_buf)
         self.running = False
         self.forwarding_threads = []
-        self.stats = {
-            'bytes_sent': 0,
-            'bytes_received': 0,
-            'packets_sent': 0,
-            'packets_received': 0,
-            'connections': 0
-        }
+        # Persistent destination connections opened with OPEN, keyed by conn id
+        self.remote_conns = {}
+        self.next_conn_id = 1
+        # Idle keep-alive connections reused by FORWARD:
+        # (host, port) -> [(socket, last_used), ...]
+        self._dest_pool = {}
+        self._dest_pool_lock = threading.Lock()
+        # Indexed by the STAT_* constants. Each slot has one writer at a
+        # time: the tunnel loop, except during CONNECT where the
+        # destination -> client thread owns the *_received slots
+        self._stats = array('Q', bytes(8 * len(STAT_FIELDS)))
     
-    def start_tunnel(self):
-        """Start tunnel forwarding"""
+    def run_tunnel(self):
+        """
+        Run tunnel forwarding in the calling thread until the client leaves
+        
+        The server calls this from the client's handler thread, so a tunnel
+        costs one thread rather than a handler plus a loop thread.
+        """
         self.running = True
         
-        # Set socket timeout for recv operations
-        self.client_socket.settimeout(1.0)
+        # Blocking reads: the loop sleeps in recv until a request arrives,
+        # and stop_tunnel shuts the socket down to wake it
+        self.client_socket.settimeout(None)
         
-        # Start listening for forwarding requests
-        tunnel_thread = threading.Thread(target=self._tunnel_loop, daemon=True)
-        tunnel_thread.start()
+        self._tunnel_loop()
+    
+    def start_tunnel(self):
+        """Start tunnel forwarding in a background thread"""
+        self.running = True
+        self.tunnel_thread = threading.Thread(target=self.run_tunnel, daemon=True)
+        self.tunnel_thread.start()
     
     def _tunnel_loop(self):
         """Main tunnel loop - handles forwarding requests from client"""
+        # Request handlers indexed by opcode
+        handlers = (
+            None,
+            self._handle_forward_request,   # CMD_FORWARD
+            self._handle_connect_request,   # CMD_CONNECT
+            self._handle_keepalive,         # CMD_KEEPALIVE
+            self._handle_stats_request,     # CMD_STATS
+            self._handle_open_request,      # CMD_OPEN
+            self._handle_send_request,      # CMD_SEND
+            self._handle_close_request,     # CMD_CLOSE
+        )
+        # Bound methods hoisted out of the per-packet path: the socket and
+        # cipher never change for the life of the tunnel
+        recv_into = self.client_socket.recv_into
+        decrypt = self.cipher.decrypt
+        unknown_handler = self._handle_data_packet
+        
         try:
             while self.running:
-                # Wait for data from client with timeout
-                ready = select.select([self.client_socket], [], [], 1.0)
-                
-                if ready[0]:
-                    try:
-                        # Receive length prefix (4 bytes) - loop to ensure we get all 4
-                        req_len_bytes = b''
-                        while len(req_len_bytes) < 4:
-                            chunk = self.client_socket.recv(4 - len(req_len_bytes))
-                            if not chunk:
-                                print(f"[TUNNEL] Connection closed while receiving length prefix")
-                                break
-                            req_len_bytes += chunk
-                        
-                        if len(req_len_bytes) != 4:
-                            print(f"[TUNNEL] Incomplete length prefix: got {len(req_len_bytes)} bytes")
+                try:
+                    # Receive length prefix (4 bytes) - MSG_WAITALL normally gets
+                    # all 4 in one call; the loop covers short reads (signals)
+                    view = self._rx_view
+                    received = 0
+                    while received < 4:
+                        count = recv_into(view[received:4], 4 - received, RECV_WAITALL)
+                        if not count:
+                            logger.info(f"[TUNNEL] Connection closed while receiving length prefix")
                             break
-                        
-                        req_len = int.from_bytes(req_len_bytes, 'big')
-                        print(f"[TUNNEL] Expecting {req_len} bytes of encrypted data")
-                        
-                        # Sanity check: reject absurdly large messages
-                        if req_len > 10 * 1024 * 1024:  # 10MB max
-                            print(f"[TUNNEL] Message too large: {req_len} bytes, skipping")
-                            continue
-                        
-                        # Receive all request data
-                        encrypted_data = b''
-                        while len(encrypted_data) < req_len:
-                            chunk = self.client_socket.recv(min(req_len - len(encrypted_data), 4096))
-                            if not chunk:
-                                print(f"[TUNNEL] Connection closed while receiving data (got {len(encrypted_data)}/{req_len})")
-                                break
-                            encrypted_data += chunk
-                        
-                        if len(encrypted_data) != req_len:
-                            print(f"[TUNNEL] Incomplete data: expected {req_len}, got {len(encrypted_data)}")
-                            continue
-                        
-                        print(f"[TUNNEL] Received complete encrypted message: {len(encrypted_data)} bytes")
-                    except socket.timeout:
-                        print(f"[TUNNEL] Recv timeout, continuing...")
-                        continue
-                    except Exception as recv_error:
-                        print(f"[TUNNEL] Receive error: {recv_error}")
+                        received += count
+                    
+                    if received != 4:
+                        logger.info(f"[TUNNEL] Incomplete length prefix: got {received} bytes")
                         break
                     
-                    # Decrypt request
-                    try:
-                        request_data = self.encryption.decrypt_aes(encrypted_data, self.aes_key)
-                        print(f"[TUNNEL] Decrypted request: {request_data[:100]}...")  # First 100 chars
-                    except Exception as decrypt_error:
-                        print(f"[TUNNEL] Decryption failed: {decrypt_error}")
-                        print(f"[TUNNEL] Encrypted data length: {len(encrypted_data)}, data sample: {encrypted_data[:32].hex()}")
-                        # Try to recover by continuing instead of breaking
+                    req_len = LENGTH_PREFIX.unpack_from(view)[0]
+                    
+                    # Sanity check: reject absurdly large messages
+                    if req_len > MAX_REQUEST_SIZE:
+                        logger.info(f"[TUNNEL] Message too large: {req_len} bytes, skipping")
                         continue
                     
-                    # Check if it's a JSON message (keepalive, stats, etc.)
-                    try:
-                        import json
-                        msg = json.loads(request_data)
-                        if msg.get('type') == 'keepalive':
-                            self._handle_keepalive()
-                            continue
-                        elif msg.get('type') == 'stats_request':
-                            self._handle_stats_request()
-                            continue
-                    except:
-                        pass  # Not JSON, process as command
+                    if 4 + req_len > len(self._rx_buf):
+                        self._rx_buf = bytearray(4 + req_len)
+                        self._rx_view = view = memoryview(self._rx_buf)
                     
-                    # Parse forwarding request (format: "FORWARD:host:port:data")
-                    if request_data.startswith('FORWARD:'):
-                        self._handle_forward_request(request_data)
-                    elif request_data.startswith('CONNECT:'):
-                        self._handle_connect_request(request_data)
-                    elif request_data.startswith('STATS_REQ'):
-                        self._handle_stats_request()
-                    else:
-                        # Unknown packet type
-                        self._handle_data_packet(request_data)
+                    # Receive all request data straight into the buffer
+                    encrypted_data = view[4:4 + req_len]
+                    received = 0
+                    while received < req_len:
+                        count = recv_into(encrypted_data[received:], req_len - received, RECV_WAITALL)
+                        if not count:
+                            logger.info(f"[TUNNEL] Connection closed while receiving data (got {received}/{req_len})")
+                            break
+                        received += count
+                    
+                    if received != req_len:
+                        logger.info(f"[TUNNEL] Incomplete data: expected {req_len}, got {received}")
+                        continue
+                    
+                except Exception as recv_error:
+                    logger.info(f"[TUNNEL] Receive error: {recv_error}")
+                    break
+                
+                # Decrypt request
+                try:
+                    # Requests stay bytes: payloads are never re-encoded as text
+                    request_data = decrypt(encrypted_data)
+                    # Per-request tracing is DEBUG only, and not even formatted otherwise
+                    if logger.isEnabledFor(logging.DEBUG):
+                        logger.debug(f"[TUNNEL] Decrypted request: {req_len} encrypted bytes, opcode {request_data[:1].hex()}")
+                except Exception as decrypt_error:
+                    logger.info(f"[TUNNEL] Decryption failed: {decrypt_error}")
+                    if logger.isEnabledFor(logging.DEBUG):
+                        logger.debug(f"[TUNNEL] Encrypted data length: {len(encrypted_data)}, data sample: {encrypted_data[:32].hex()}")
+                    # The receive counter only advances on success, so every
+                    # later frame would fail too: drop the tunnel and let the
+                    # client reconnect
+                    break
+                
+                # Dispatch on the opcode byte (see shared.commands)
+                op = request_data[0] if request_data else 0
+                handler = handlers[op] if op < len(handlers) else None
+                if handler is None:
+                    # Unknown packet type
+                    unknown_handler(request_data)
+                elif handler(request_data):
+                    break  # CONNECT: the client socket now carries the raw stream
         
         except Exception as e:
-            print(f"[TUNNEL] Error in tunnel loop: {e}")
+            logger.info(f"[TUNNEL] Error in tunnel loop: {e}")
         finally:
             self.stop_tunnel()
     
-    def _handle_forward_request(self, request: str):
+    def _handle_forward_request(self, request: bytes):
         """
         Handle traffic forwarding request
-        Format: FORWARD:destination_host:destination_port:data
+        Format: CMD_FORWARD address header, then the data to forward
         """
+        conn = None
         try:
-            parts = request.split(':', 3)
-            if len(parts) >= 3:
-                dest_host = parts[1]
-                dest_port = int(parts[2])
-                data = parts[3] if len(parts) > 3 else ""
-                
-                print(f"[TUNNEL] Forwarding to {dest_host}:{dest_port}, data length: {len(data)}")
-                
-                # Create connection to destination
-                dest_socket = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
-                dest_socket.settimeout(10)
-                dest_socket.connect((dest_host, dest_port))
-                
-                self.stats['connections'] += 1
-                
-                # Send data if provided
-                if data:
-                    dest_socket.sendall(data.encode())
-                    self.stats['bytes_sent'] += len(data)
-                    self.stats['packets_sent'] += 1
-                
-                # Receive response
-                response = dest_socket.recv(DEFAULT_BUFFER_SIZE)
-                self.stats['bytes_received'] += len(response)
-                self.stats['packets_received'] += 1
-                
-                print(f"[TUNNEL] Received {len(response)} bytes from {dest_host}:{dest_port}")
-                
-                # Send encrypted response back to client as JSON
-                # Use latin-1 for HTTP responses (supports all byte values)
-                response_json = json.dumps({
-                    'status': 'success',
-                    'data': response.decode('latin-1')
-                })
-                encrypted_response = self.encryption.encrypt_aes(
-                    response_json,
-                    self.aes_key
-                )
-                
-                # Send with length prefix
-                resp_len = len(encrypted_response)
-                print(f"[TUNNEL] Sending response: {resp_len} encrypted bytes")
-                try:
-                    self.client_socket.sendall(resp_len.to_bytes(4, 'big'))
-                    self.client_socket.sendall(encrypted_response)
-                    print(f"[TUNNEL] Response sent successfully")
-                except Exception as send_err:
-                    print(f"[TUNNEL] Failed to send response: {send_err}")
+            dest_host, dest_port, data = unpack_address(request)
+            
+            if logger.isEnabledFor(logging.DEBUG):
+                logger.debug(f"[TUNNEL] Forwarding to {dest_host}:{dest_port}, data length: {len(data)}")
+            
+            # Reuse an idle connection to this destination if there is one
+            key = (dest_host, dest_port)
+            conn = {'host': dest_host, 'port': dest_port, 'socket': self._checkout_dest(key)}
+            pooled = conn['socket'] is not None
+            # The reply is built in one buffer: status line, then the whole
+            # response as read (Content-Length, chunked or EOF framing)
+            reply = bytearray(FORWARD_OK_HEADER)
+            try:
+                self._exchange_remote(conn, data, reply.extend)
+            except OSError:
+                if not pooled or len(reply) > len(FORWARD_OK_HEADER):
                     raise
-                
-                dest_socket.close()
+                # A pooled connection may have been dropped while idle; a
+                # fresh one that failed is not dialled again
+                self._close_remote(conn)
+                self._exchange_remote(conn, data, reply.extend)
+            
+            # Whole response read, so the connection can serve the next FORWARD
+            if conn['socket']:
+                self._checkin_dest(key, conn['socket'])
+                conn['socket'] = None  # Owned by the pool now
+            if logger.isEnabledFor(logging.DEBUG):
+                logger.debug(f"[TUNNEL] Received {len(reply) - len(FORWARD_OK_HEADER)} bytes from {dest_host}:{dest_port}")
+            
+            # Send encrypted response back to client in a single frame: a
+            # JSON status line followed by the raw response body
+            try:
+                self._send_encrypted(reply)
+            except Exception as send_err:
+                logger.info(f"[TUNNEL] Failed to send response: {send_err}")
+                raise
         
         except Exception as e:
-            print(f"[TUNNEL] Forward error: {e}")
-            error_json = json.dumps({
+            logger.info(f"[TUNNEL] Forward error: {e}")
+            if conn:
+                self._close_remote(conn)
+            self._send_encrypted(json.dumps({
                 'status': 'error',
                 'error': str(e)
-            })
-            encrypted_error = self.encryption.encrypt_aes(error_json, self.aes_key)
+            }))
+    
+    def _handle_open_request(self, request: bytes):
+        """
+        Open a persistent connection to a destination
+        Format: CMD_OPEN address header
+        Replies with the conn id to use in CMD_SEND requests
+        """
+        try:
+            dest_host, dest_port, _ = unpack_address(request)
+            conn = {'host': dest_host, 'port': dest_port, 'socket': None}
+            self._connect_remote(conn)
             
-            # Send with length prefix
-            err_len = len(encrypted_error)
-            self.client_socket.sendall(err_len.to_bytes(4, 'big'))
-            self.client_socket.sendall(encrypted_error)
+            conn_id = self.next_conn_id
+            self.next_conn_id += 1
+            self.remote_conns[conn_id] = conn
+            
+            logger.info(f"[TUNNEL] Opened connection {conn_id} to {dest_host}:{dest_port}")
+            self._send_encrypted(json.dumps({'status': 'success', 'conn_id': conn_id}))
+        
+        except Exception as e:
+            logger.info(f"[TUNNEL] Open error: {e}")
+            self._send_encrypted(json.dumps({'status': 'error', 'error': str(e)}))
     
-    def _handle_connect_request(self, request: str):
+    def _handle_send_request(self, request: bytes):
+        """
+        Send an HTTP request over a persistent destination connection
+        Format: CMD_SEND connection header, then the request bytes
+        
+        The response is streamed back as it arrives from the destination:
+        a STREAM_OK_HEADER frame carrying the first piece, further body
+        frames, then an empty frame.
+        """
+        streaming = False
+        conn = None
+        
+        def relay(piece: bytes):
+            nonlocal streaming
+            if not streaming:
+                streaming = True
+                piece = STREAM_OK_HEADER + piece
+            self._send_encrypted(piece)
+        
+        try:
+            conn_id, payload = unpack_connection(request)
+            conn = self.remote_conns.get(conn_id)
+            if conn is None:
+                raise ValueError(f"Unknown connection {conn_id}")
+            
+            try:
+                self._exchange_remote(conn, payload, relay)
+            except OSError as e:
+                if streaming or not conn['served']:
+                    raise
+                # The destination may have dropped an idle keep-alive
+                # connection; a fresh one that failed is not dialled again,
+                # as the request may already have reached the destination
+                logger.info(f"[TUNNEL] Connection {conn_id} lost ({e}), reconnecting")
+                self._close_remote(conn)
+                self._exchange_remote(conn, payload, relay)
+            
+            self._send_encrypted(b'')
+        
+        except Exception as e:
+            logger.info(f"[TUNNEL] Send error: {e}")
+            if conn:
+                # Drop the connection so the next SEND dials a fresh one
+                self._close_remote(conn)
+            if streaming:
+                # Too late for an error reply: end the stream
+                self._send_encrypted(b'')
+            else:
+                self._send_encrypted(json.dumps({'status': 'error', 'error': str(e)}))
+    
+    def _handle_close_request(self, request: bytes):
+        """
+        Close a persistent destination connection
+        Format: CMD_CLOSE connection header
+        """
+        conn_id, _ = unpack_connection(request)
+        conn = self.remote_conns.pop(conn_id, None)
+        if conn:
+            self._close_remote(conn)
+        self._send_encrypted(FORWARD_OK_HEADER)
+    
+    def _connect_remote(self, conn: dict):
+        """(Re)connect a persistent destination connection"""
+        dest_socket = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
+        dest_socket.settimeout(10)
+        # Sized before connect so the window scale is negotiated to match
+        dest_socket.setsockopt(socket.SOL_SOCKET, socket.SO_RCVBUF, config.SOCKET_BUFFER_SIZE)
+        dest_socket.setsockopt(socket.SOL_SOCKET, socket.SO_SNDBUF, config.SOCKET_BUFFER_SIZE)
+        dest_socket.connect((conn['host'], conn['port']))
+        # Requests go out in one sendall, so don't let Nagle hold the tail
+        dest_socket.setsockopt(socket.IPPROTO_TCP, socket.TCP_NODELAY, 1)
+        dest_socket.setsockopt(socket.SOL_SOCKET, socket.SO_KEEPALIVE, 1)
+        conn['socket'] = dest_socket
+        conn['served'] = False  # No response read on this socket yet
+        self._stats[STAT_CONNECTIONS] += 1
+    
+    def _checkout_dest(self, key: tuple) -> Optional[socket.socket]:
+        """Take an idle pooled connection to (host, port), None if there is none"""
+        now = time.monotonic()
+        with self._dest_pool_lock:
+            idle = self._dest_pool.get(key)
+            while idle:
+                dest_socket, last_used = idle.pop()
+                if now - last_used < DEST_IDLE_TIMEOUT:
+                    return dest_socket
+                dest_socket.close()
+        return None
+    
+    def _checkin_dest(self, key: tuple, dest_socket: socket.socket):
+        """
+        Return a connection to the FORWARD pool
+        
+        Connections idle past DEST_IDLE_TIMEOUT are closed here, so the
+        pool is swept on use rather than by a janitor thread.
+        """
+        now = time.monotonic()
+        with self._dest_pool_lock:
+            for idle in self._dest_pool.values():
+                while idle and now - idle[0][1] >= DEST_IDLE_TIMEOUT:
+                    idle.pop(0)[0].close()  # Oldest first
+            self._dest_pool.setdefault(key, []).append((dest_socket, now))
+    
+    def _close_remote(self, conn: dict):
+        """Close the socket of a persistent destination connection"""
+        if conn['socket']:
+            try:
+                conn['socket'].close()
+            except:
+                pass
+            conn['socket'] = None
+    
+    def _exchange_remote(self, conn: dict, payload: bytes, relay):
+        """
+        Send one request on a persistent connection and relay the response
+        
+        Reconnects first if the previous response closed the connection.
+        
+        Args:
+            conn: Persistent connection entry
+            payload: Raw HTTP request
+            relay: Called with each piece of the response as it arrives
+        """
+        if conn['socket'] is None:
+            self._connect_remote(conn)
+        
+        conn['socket'].sendall(payload)
+        stats = self._stats
+        stats[STAT_BYTES_SENT] += len(payload)
+        stats[STAT_PACKETS_SENT] += 1
+        
+        received = 0
+        
+        def count_and_relay(piece: bytes):
+            nonlocal received
+            received += len(piece)
+            relay(piece)
+        
+        reusable = self._relay_http_response(
+            conn['socket'], count_and_relay, head_request=payload.startswith(b'HEAD ')
+        )
+        if not received:
+            raise ConnectionResetError("Destination closed the connection")
+        
+        stats[STAT_BYTES_RECEIVED] += received
+        stats[STAT_PACKETS_RECEIVED] += 1
+        
+        if reusable:
+            conn['served'] = True
+        else:
+            self._close_remote(conn)
+    
+    def _relay_http_response(self, dest_socket: socket.socket, relay, head_request: bool = False) -> bool:
+        """
+        Read exactly one HTTP response from a destination socket
+        
+        Pieces are handed to relay as soon as they are received, so only
+        the unparsed tail is ever buffered. Uses Content-Length or chunked
+        framing so the connection can carry the next request; responses
+        without either are read until EOF.
+        
+        Returns:
+            True if the connection can be reused for another request
+        """
+        buf = bytearray()
+        
+        def fill(size: int) -> bool:
+            """Receive until the buffer holds at least size bytes"""
+            while len(buf) < size:
+                chunk = dest_socket.recv(RELAY_RECV_SIZE)
+                if not chunk:
+                    return False
+                buf.extend(chunk)
+            return True
+        
+        def find_crlf() -> int:
+            """Receive until the buffer holds a CRLF (-1 on EOF)"""
+            index = buf.find(b'\r\n')
+            while index == -1:
+                scan_start = max(0, len(buf) - 1)
+                if not fill(len(buf) + 1):
+                    return -1
+                index = buf.find(b'\r\n', scan_start)
+            return index
+        
+        def consume(size: int) -> bool:
+            """Relay the next size bytes of the response"""
+            while size > 0:
+                if not buf and not fill(1):
+                    return False
+                piece = bytes(buf[:size])
+                del buf[:len(piece)]
+                relay(piece)
+                size -= len(piece)
+            return True
+        
+        # Headers
+        header_end = -1
+        while header_end == -1:
+            scan_start = max(0, len(buf) - 3)
+            if not fill(len(buf) + 1):
+                consume(len(buf))
+                return False
+            header_end = buf.find(b'\r\n\r\n', scan_start)
+        header_end += 4
+        
+        status_line, _, header_block = bytes(buf[:header_end - 4]).lower().partition(b'\r\n')
+        headers = {}
+        for line in header_block.split(b'\r\n'):
+            name, sep, value = line.partition(b':')
+            if sep:
+                headers[name.strip()] = value.strip()
+        
+        parts = status_line.split()
+        status = int(parts[1]) if len(parts) > 1 and parts[1].isdigit() else 0
+        if status_line.startswith(b'http/1.0'):
+            reusable = headers.get(b'connection') == b'keep-alive'
+        else:
+            reusable = headers.get(b'connection') != b'close'
+        
+        consume(header_end)
+        
+        # Body
+        if head_request or status in (204, 304):
+            pass
+        elif b'content-length' in headers:
+            if not consume(int(headers[b'content-length'])):
+                return False
+        elif headers.get(b'transfer-encoding', b'').endswith(b'chunked'):
+            while True:
+                line_end = find_crlf()
+                if line_end == -1:
+                    return False
+                size = int(bytes(buf[:line_end]).split(b';')[0], 16)
+                if not consume(line_end + 2):
+                    return False
+                if size == 0:
+                    # Last chunk: optional trailer lines, then a blank line
+                    line_end = find_crlf()
+                    while line_end > 0:
+                        consume(line_end + 2)
+                        line_end = find_crlf()
+                    if line_end == -1 or not consume(2):
+                        return False
+                    break
+                if not consume(size + 2):
+                    return False
+        else:
+            # No framing: the body runs until the destination closes
+            while buf or fill(1):
+                consume(len(buf))
+            reusable = False
+        
+        # Bytes past the end of the response mean the stream is out of step
+        return reusable and not buf
+    
+    def _send_encrypted(self, payload):
+        """Encrypt a reply and send it with its length prefix"""
+        self.client_socket.sendall(self.cipher.seal_frame(payload))
+    
+    def _handle_connect_request(self, request: bytes) -> bool:
         """
         Handle persistent connection request
         Creates bidirectional forwarding
+        
+        Returns:
+            True if the tunnel was handed over to the forwarded stream
         """
         try:
-            # Format: CONNECT:host:port
-            parts = request.split(':')
-            dest_host = parts[1]
-            dest_port = int(parts[2])
+            # Format: CMD_CONNECT address header
+            dest_host, dest_port, _ = unpack_address(request)
             
             # Create destination socket
             dest_socket = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
+            dest_socket.setsockopt(socket.SOL_SOCKET, socket.SO_RCVBUF, config.SOCKET_BUFFER_SIZE)
+            dest_socket.setsockopt(socket.SOL_SOCKET, socket.SO_SNDBUF, config.SOCKET_BUFFER_SIZE)
             dest_socket.connect((dest_host, dest_port))
             
-            self.stats['connections'] += 1
+            self._stats[STAT_CONNECTIONS] += 1
             
             # Send success response
-            success_msg = "CONNECT_OK"
-            encrypted_msg = self.encryption.encrypt_aes(success_msg, self.aes_key)
-            self.client_socket.send(encrypted_msg)
-            
-            # Start bidirectional forwarding
-            self._forward_bidirectional(dest_socket)
+            self._send_encrypted(b"CONNECT_OK")
         
         except Exception as e:
-            error_msg = f"CONNECT_ERROR:{str(e)}"
-            encrypted_error = self.encryption.encrypt_aes(error_msg, self.aes_key)
-            self.client_socket.send(encrypted_error)
+            self._send_encrypted(f"CONNECT_ERROR:{str(e)}")
+            return False
+        
+        # Start bidirectional forwarding
+        self._forward_bidirectional(dest_socket)
+        return True
     
     def _forward_bidirectional(self, dest_socket: socket.socket):
         """
         Forward traffic bidirectionally between client and destination
         This is the core of VPN tunneling
-        """
-        # Thread 1: Client -> Destination
-        def forward_to_dest():
-            try:
-                while self.running:
-                    encrypted_data = self.client_socket.recv(DEFAULT_BUFFER_SIZE)
-                    if not encrypted_data:
-                        break
-                    
-                    # Decrypt and forward
-                    plain_data = self.encryption.decrypt_aes(encrypted_data, self.aes_key)
-                    dest_socket.send(plain_data.encode())
-                    
-                    self.stats['bytes_sent'] += len(plain_data)
-                    self.stats['packets_sent'] += 1
-            except:
-                pass
-            finally:
-                dest_socket.close()
         
-        # Thread 2: Destination -> Client
+        Each direction is a stream of tunnel frames through the long-lived
+        cipher. Client -> destination runs in the calling (tunnel loop)
+        thread, so only one thread ever reads client frames.
+        """
+        # Thread: Destination -> Client
         def forward_to_client():
+            # One receive buffer for the whole stream; AES-GCM encrypts
+            # straight from a view of it
+            buf = bytearray(RELAY_RECV_SIZE)
+            view = memoryview(buf)
+            stats = self._stats
             try:
                 while self.running:
-                    data = dest_socket.recv(DEFAULT_BUFFER_SIZE)
-                    if not data:
+                    count = dest_socket.recv_into(buf)
+                    if not count:
                         break
                     
-                    # Encrypt and forward
-                    encrypted_data = self.encryption.encrypt_aes(
-                        data.decode('utf-8', errors='ignore'),
-                        self.aes_key
-                    )
-                    self.client_socket.send(encrypted_data)
+                    # Encrypt and forward the raw bytes
+                    self._send_encrypted(view[:count])
                     
-                    self.stats['bytes_received'] += len(data)
-                    self.stats['packets_received'] += 1
+                    stats[STAT_BYTES_RECEIVED] += count
+                    stats[STAT_PACKETS_RECEIVED] += 1
             except:
                 pass
             finally:
                 self.client_socket.close()
         
-        # Start both forwarding threads
-        t1 = threading.Thread(target=forward_to_dest, daemon=True)
-        t2 = threading.Thread(target=forward_to_client, daemon=True)
+        t = threading.Thread(target=forward_to_client, daemon=True)
+        t.start()
+        self.forwarding_threads.append(t)
         
-        t1.start()
-        t2.start()
+        # Client -> Destination: block until either side closes
+        stats = self._stats
+        try:
+            while self.running:
+                frame = self._recv_frame()
+                if frame is None:
+                    break
+                
+                # Decrypt and forward
+                plain_data = self.cipher.decrypt(frame)
+                dest_socket.sendall(plain_data)
+                
+                stats[STAT_BYTES_SENT] += len(plain_data)
+                stats[STAT_PACKETS_SENT] += 1
+        except:
+            pass
+        finally:
+            dest_socket.close()
+    
+    def _recv_frame(self) -> Optional[memoryview]:
+        """
+        Receive one length-prefixed frame from the client (None on EOF)
         
-        self.forwarding_threads.extend([t1, t2])
+        The frame is read into the tunnel's receive buffer; the returned
+        view is only valid until the next call.
+        """
+        if not self._recv_exact(0, 4):
+            return None
+        size = LENGTH_PREFIX.unpack_from(self._rx_view)[0]
+        if size > MAX_REQUEST_SIZE:
+            raise ValueError(f"Frame too large: {size} bytes")
+        if 4 + size > len(self._rx_buf):
+            self._rx_buf = bytearray(4 + size)
+            self._rx_view = memoryview(self._rx_buf)
+        if not self._recv_exact(4, size):
+            return None
+        return self._rx_view[4:4 + size]
     
-    def _handle_data_packet(self, data: str):
+    def _recv_exact(self, offset: int, size: int) -> bool:
+        """Receive exactly size bytes into the receive buffer at offset (False on EOF)"""
+        view = self._rx_view[offset:offset + size]
+        received = 0
+        while received < size:
+            count = self.client_socket.recv_into(view[received:], size - received, RECV_WAITALL)
+            if not count:
+                return False
+            received += count
+        return True
+    
+    def _handle_data_packet(self, data: bytes):
         """Handle regular data packet (for statistics, keepalive, etc.)"""
-        self.stats['packets_received'] += 1
+        self._stats[STAT_PACKETS_RECEIVED] += 1
         
         # Echo back acknowledgment with length prefix
-        ack_json = json.dumps({'status': 'ack', 'size': len(data)})
-        encrypted_ack = self.encryption.encrypt_aes(ack_json, self.aes_key)
-        
-        ack_len = len(encrypted_ack)
-        self.client_socket.sendall(ack_len.to_bytes(4, 'big'))
-        self.client_socket.sendall(encrypted_ack)
+        self._send_encrypted(json.dumps({'status': 'ack', 'size': len(data)}))
     
-    def _handle_keepalive(self):
+    def _handle_keepalive(self, request: bytes):
         """Handle keepalive packet"""
         # Send keepalive acknowledgment
-        ack_json = json.dumps({'status': 'ok', 'type': 'keepalive_ack'})
-        encrypted_ack = self.encryption.encrypt_aes(ack_json, self.aes_key)
-        
-        ack_len = len(encrypted_ack)
-        self.client_socket.sendall(ack_len.to_bytes(4, 'big'))
-        self.client_socket.sendall(encrypted_ack)
+        self._send_encrypted(KEEPALIVE_ACK)
     
-    def _handle_stats_request(self):
+    def _handle_stats_request(self, request: bytes):
         """Handle statistics request"""
-        stats_json = json.dumps(self.stats)
-        encrypted_stats = self.encryption.encrypt_aes(stats_json, self.aes_key)
-        
-        stats_len = len(encrypted_stats)
-        self.client_socket.sendall(stats_len.to_bytes(4, 'big'))
-        self.client_socket.sendall(encrypted_stats)
+        self._send_encrypted(STATS_TEMPLATE % tuple(self._stats))
     
     def stop_tunnel(self):
         """Stop tunnel and cleanup"""
         self.running = False
         
+        # Wake the tunnel loop if it is blocked in recv
+        try:
+            self.client_socket.shutdown(socket.SHUT_RDWR)
+        except OSError:
+            pass  # Already closed
+        
+        # Close persistent destination connections
+        for conn in list(self.remote_conns.values()):
+            self._close_remote(conn)
+        self.remote_conns.clear()
+        
+        with self._dest_pool_lock:
+            for idle in self._dest_pool.values():
+                for dest_socket, _ in idle:
+                    dest_socket.close()
+            self._dest_pool.clear()
+        
         # Wait for forwarding threads to finish
         for thread in self.forwarding_threads:
             thread.join(timeout=1.0)
     
     def get_stats(self) -> dict:
         """Get tunnel statistics"""
-        return self.stats.copy()
+        return dict(zip(STAT_FIELDS, self._stats))
@@ -6,9 +6,11 @@ Handles client connections, encryption, and tunneling
 import socket
 import threading
 import json
+import logging
 import os
 import time
 import sys
+from concurrent.futures import ThreadPoolExecutor
 
 # Add parent directory to path
 sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
@@ -18,6 +20,8 @@ from shared.constants import DEFAULT_BUFFER_SIZE
 from . import config
 from .auth_handler import AuthHandler
 
+logger = logging.getLogger('vpn_server')
+
 
 class VPNServer:
     """VPN Server with encryption and authentication"""
@@ -28,12 +32,17 @@ class VPNServer:
         self.server_socket = None
         self.clients = {}
         self.running = False
+        # Bounded client handling: MAX_CLIENTS worker threads, and a slot
+        # taken per accepted connection until its handler returns
+        self.pool = None
+        self.client_slots = threading.BoundedSemaphore(config.MAX_CLIENTS)
         
-        # Generate RSA key pair
-        self.private_key, self.public_key = RSAHandler.generate_key_pair()
+        # Load RSA key pair (generated and saved on first start)
+        self.private_key, self.public_key = RSAHandler.load_or_generate_key_pair(config.SERVER_KEY_FILE)
+        # The key never changes, so serialize it once rather than per client
+        self.public_pem = RSAHandler.serialize_public_key(self.public_key)
         
         # Initialize handlers
-        self.encryption = EncryptionHandler()
         self.auth = AuthHandler()
         
         self._log(f"VPN Server initialized on {self.host}:{self.port}")
@@ -44,26 +53,30 @@ class VPNServer:
             self.server_socket = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
             self.server_socket.setsockopt(socket.SOL_SOCKET, socket.SO_REUSEADDR, 1)
             self.server_socket.bind((self.host, self.port))
-            self.server_socket.listen(config.MAX_CLIENTS)
+            # New clients wait in the backlog while every handler slot is busy
+            self.server_socket.listen(socket.SOMAXCONN)
             self.running = True
+            self.pool = ThreadPoolExecutor(max_workers=config.MAX_CLIENTS, thread_name_prefix='vpn-client')
             
             self._log(f"Server listening on {self.host}:{self.port}")
             self._log("Waiting for client connections...")
             
             while self.running:
+                # Back-pressure: only accept when a handler slot is free
+                self.client_slots.acquire()
                 try:
                     client_socket, address = self.server_socket.accept()
+                    # A peer that never finishes the handshake must not pin a
+                    # handler slot; cleared once the tunnel is up
+                    client_socket.settimeout(config.HANDSHAKE_TIMEOUT)
                     self._log(f"New connection from {address}")
                     
-                    # Handle client in separate thread
-                    client_thread = threading.Thread(
-                        target=self._handle_client,
-                        args=(client_socket, address),
-                        daemon=True
-                    )
-                    client_thread.start()
+                    # Handle client on a pool worker; the slot frees when it returns
+                    future = self.pool.submit(self._handle_client, client_socket, address)
+                    future.add_done_callback(self._release_client_slot)
                     
                 except Exception as e:
+                    self.client_slots.release()
                     if self.running:
                         self._log(f"Error accepting connection: {e}", level='ERROR')
         
@@ -71,22 +84,27 @@ class VPNServer:
             self._log(f"Failed to start server: {e}", level='ERROR')
             raise
     
+    def _release_client_slot(self, future):
+        """Free the handler slot of a finished client"""
+        self.client_slots.release()
+    
     def _handle_client(self, client_socket: socket.socket, address: tuple):
         """Handle individual client connection"""
         try:
             # Step 1: Send server's public key
-            public_pem = RSAHandler.serialize_public_key(self.public_key)
-            client_socket.send(public_pem)
+            client_socket.send(self.public_pem)
             self._log(f"Sent public key to {address}")
             
             # Step 2: Receive encrypted AES key
             encrypted_aes_key = client_socket.recv(512)
             aes_key = RSAHandler.decrypt_rsa(encrypted_aes_key, self.private_key)
             self._log(f"Received and decrypted AES key from {address}")
+            # One AEAD context for every message of this session
+            client_cipher = EncryptionHandler(aes_key)
             
             # Step 3: Receive encrypted authentication
             encrypted_token = client_socket.recv(1024)
-            auth_json = self.encryption.decrypt_aes(encrypted_token, aes_key)
+            auth_json = client_cipher.decrypt(encrypted_token)
             
             # Step 4: Validate credentials
             username, password, timestamp = self.auth.parse_auth_data(auth_json)
@@ -98,7 +116,7 @@ class VPNServer:
                     message='VPN tunnel established',
                     server_info={'server_ip': self.host}
                 )
-                encrypted_response = self.encryption.encrypt_aes(response, aes_key)
+                encrypted_response = client_cipher.encrypt(response)
                 client_socket.send(encrypted_response)
                 
                 self._log(f"✓ Client {address} authenticated as '{username}'")
@@ -108,20 +126,22 @@ class VPNServer:
                 self.clients[address] = {
                     'socket': client_socket,
                     'aes_key': aes_key,
+                    'cipher': client_cipher,
                     'username': username,
                     'authenticated': True,
                     'connected_at': time.time()
                 }
                 
-                # Handle tunnel
-                self._handle_tunnel(client_socket, address, aes_key)
+                # Handle tunnel - it may sit idle, so the handshake deadline goes
+                client_socket.settimeout(None)
+                self._handle_tunnel(client_socket, address, client_cipher)
             else:
                 # Authentication failed
                 response = self.auth.create_auth_response(
                     success=False,
                     message='Authentication failed: Invalid credentials'
                 )
-                encrypted_response = self.encryption.encrypt_aes(response, aes_key)
+                encrypted_response = client_cipher.encrypt(response)
                 client_socket.send(encrypted_response)
                 self._log(f"✗ Authentication failed for {address}", level='WARNING')
                 client_socket.close()
@@ -135,7 +155,7 @@ class VPNServer:
             except:
                 pass
     
-    def _handle_tunnel(self, client_socket: socket.socket, address: tuple, aes_key: bytes):
+    def _handle_tunnel(self, client_socket: socket.socket, address: tuple, cipher: EncryptionHandler):
         """Handle VPN tunnel for data transmission"""
         try:
             while self.running:
@@ -145,7 +165,7 @@ class VPNServer:
                     break
                 
                 # Decrypt data
-                decrypted_data = self.encryption.decrypt_aes(data, aes_key)
+                decrypted_data = cipher.decrypt(data)
                 self._log(f"Received from {address}: {len(decrypted_data)} bytes")
                 
                 # Send acknowledgment
@@ -154,7 +174,7 @@ class VPNServer:
                     'timestamp': time.time(),
                     'bytes_received': len(decrypted_data)
                 })
-                encrypted_ack = self.encryption.encrypt_aes(ack, aes_key)
+                encrypted_ack = cipher.encrypt(ack)
                 client_socket.send(encrypted_ack)
         
         except Exception as e:
@@ -168,12 +188,24 @@ class VPNServer:
     def stop(self):
         """Stop the VPN server"""
         self.running = False
+        # Pool workers are not daemon threads: wake the ones blocked in recv
+        # on a client socket, or the interpreter waits on them at exit
+        for client_info in list(self.clients.values()):
+            try:
+                client_info['socket'].shutdown(socket.SHUT_RDWR)
+            except:
+                pass
+            try:
+                client_info['socket'].close()
+            except:
+                pass
         if self.server_socket:
             self.server_socket.close()
+        if self.pool:
+            self.pool.shutdown(wait=False)
         self._log("Server stopped")
     
     def _log(self, message: str, level: str = 'INFO'):
-        """Log message with timestamp"""
+        """Log message with timestamp (formatted by the logging handler)"""
         if config.VERBOSE_LOGGING or level != 'INFO':
-            timestamp = time.strftime("%H:%M:%S")
-            print(f"[{timestamp}] [{level}] {message}")
+            logger.log(getattr(logging, level, logging.INFO), message)
@@ -6,19 +6,33 @@ Implements real VPN functionality with packet forwarding
 import socket
 import threading
 import json
+import logging
 import os
 import time
 import sys
+from collections import deque
+from concurrent.futures import ThreadPoolExecutor
+
+try:
+    import orjson
+except ImportError:  # Optional C JSON codec - fall back to the stdlib
+    orjson = None
 
 sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
 
-from shared.encryption import EncryptionHandler, RSAHandler
+from shared.encryption import EncryptionHandler, RSAHandler, select_cipher_suite
+from shared.framing import send_frame, recv_frame, LENGTH_PREFIX
 from shared.constants import DEFAULT_BUFFER_SIZE
 from . import config
 from .auth_handler import AuthHandler
 from .tunnel_manager import TunnelManager
 from .flow_control import FlowController
 
+logger = logging.getLogger('vpn_server')
+
+# Largest handshake frame (RSA-wrapped key or encrypted credentials) accepted
+HANDSHAKE_MAX_SIZE = 65536
+
 
 class VPNServerEnhanced:
     """
@@ -37,12 +51,25 @@ class VPNServerEnhanced:
         self.server_socket = None
         self.clients = {}
         self.running = False
+        # Bounded client handling: MAX_CLIENTS worker threads, and a slot
+        # taken per accepted connection until its handler returns
+        self.pool = None
+        self.client_slots = threading.BoundedSemaphore(config.MAX_CLIENTS)
+        # Pending statistics report (re-armed after each one)
+        self._stats_timer = None
+        # Idle flow controllers, reset and handed to the next client (at
+        # most MAX_CLIENTS are ever in use, which bounds the pool)
+        self._flow_pool = deque()
         
-        # Generate RSA key pair
-        self.private_key, self.public_key = RSAHandler.generate_key_pair()
+        # Load RSA key pair (generated and saved on first start)
+        self.private_key, self.public_key = RSAHandler.load_or_generate_key_pair(config.SERVER_KEY_FILE)
+        # The key never changes, so serialize it once rather than per client
+        self.public_pem = RSAHandler.serialize_public_key(self.public_key)
+        # Sent as the first handshake frame: length prefix and PEM prebuilt
+        # so each new client gets them in a single write
+        self.public_key_frame = LENGTH_PREFIX.pack(len(self.public_pem)) + self.public_pem
         
         # Initialize handlers
-        self.encryption = EncryptionHandler()
         self.auth = AuthHandler()
         
         # Global statistics
@@ -65,8 +92,15 @@ class VPNServerEnhanced:
             # Set TCP keepalive
             self.server_socket.setsockopt(socket.SOL_SOCKET, socket.SO_KEEPALIVE, 1)
             
+            # Buffer sizes set on the listener are inherited by accepted
+            # sockets, in time for the TCP window scale negotiated in the handshake
+            self.server_socket.setsockopt(socket.SOL_SOCKET, socket.SO_RCVBUF, config.SOCKET_BUFFER_SIZE)
+            self.server_socket.setsockopt(socket.SOL_SOCKET, socket.SO_SNDBUF, config.SOCKET_BUFFER_SIZE)
+            
             self.server_socket.bind((self.host, self.port))
-            self.server_socket.listen(config.MAX_CLIENTS)
+            # A full backlog queue lets new clients wait in the kernel while
+            # every handler slot is busy
+            self.server_socket.listen(socket.SOMAXCONN)
             self.running = True
             
             self._log(f"Server listening on {self.host}:{self.port}")
@@ -76,34 +110,42 @@ class VPNServerEnhanced:
             self._log("="*70)
             
             # Start statistics reporter
-            stats_thread = threading.Thread(target=self._stats_reporter, daemon=True)
-            stats_thread.start()
+            self._schedule_stats_report()
+            
+            self.pool = ThreadPoolExecutor(max_workers=config.MAX_CLIENTS, thread_name_prefix='vpn-client')
             
             while self.running:
+                # Back-pressure: with every handler busy, stop accepting and
+                # leave new connections in the listen backlog
+                if not self.client_slots.acquire(timeout=1.0):
+                    continue
                 try:
                     # Set timeout on accept() for responsive Ctrl+C
                     self.server_socket.settimeout(1.0)
                     client_socket, address = self.server_socket.accept()
                     
                     # Configure socket options
+                    # A peer that never finishes the handshake must not pin a
+                    # handler slot; run_tunnel() clears this once authenticated
+                    client_socket.settimeout(config.HANDSHAKE_TIMEOUT)
                     client_socket.setsockopt(socket.IPPROTO_TCP, socket.TCP_NODELAY, 1)
                     client_socket.setsockopt(socket.SOL_SOCKET, socket.SO_KEEPALIVE, 1)
+                    if hasattr(socket, 'TCP_NOTSENT_LOWAT'):  # Linux/macOS only
+                        client_socket.setsockopt(socket.IPPROTO_TCP, socket.TCP_NOTSENT_LOWAT, config.TCP_NOTSENT_LOWAT)
                     
                     self._log(f"📥 New connection from {address}")
                     self.global_stats['total_connections'] += 1
                     
-                    # Handle client in separate thread
-                    client_thread = threading.Thread(
-                        target=self._handle_client,
-                        args=(client_socket, address),
-                        daemon=True
-                    )
-                    client_thread.start()
+                    # Handle client on a pool worker; the slot frees when it returns
+                    future = self.pool.submit(self._handle_client, client_socket, address)
+                    future.add_done_callback(self._release_client_slot)
                 
                 except socket.timeout:
                     # Expected - allows checking self.running flag
+                    self.client_slots.release()
                     continue
                 except Exception as e:
+                    self.client_slots.release()
                     if self.running:
                         self._log(f"Error accepting connection: {e}", level='ERROR')
         
@@ -111,89 +153,68 @@ class VPNServerEnhanced:
             self._log(f"Failed to start server: {e}", level='ERROR')
             raise
     
+    def _release_client_slot(self, future):
+        """Free the handler slot of a finished client"""
+        self.client_slots.release()
+    
     def _handle_client(self, client_socket: socket.socket, address: tuple):
         """Handle individual client connection with full VPN features"""
-        flow_controller = FlowController()
+        try:
+            flow_controller = self._flow_pool.pop()
+        except IndexError:
+            flow_controller = FlowController()
         tunnel_manager = None
         
         try:
-            # Step 1: Send server's public key
-            public_pem = RSAHandler.serialize_public_key(self.public_key)
-            client_socket.sendall(public_pem)
+            # Step 1: Send server's public key (length-prefixed like every frame)
+            client_socket.sendall(self.public_key_frame)
             self._log(f"[{address}] 🔑 Sent RSA public key")
             
             # Step 2: Receive encrypted AES key with length prefix
-            key_len_bytes = b''
-            while len(key_len_bytes) < 4:
-                chunk = client_socket.recv(4 - len(key_len_bytes))
-                if not chunk:
-                    raise Exception("Connection closed during key length receive")
-                key_len_bytes += chunk
-            
-            if len(key_len_bytes) != 4:
-                raise Exception("Failed to receive AES key length")
-            key_len = int.from_bytes(key_len_bytes, 'big')
-            
-            # Receive all encrypted key bytes
-            encrypted_aes_key = b''
-            while len(encrypted_aes_key) < key_len:
-                chunk = client_socket.recv(min(key_len - len(encrypted_aes_key), 4096))
-                if not chunk:
-                    raise Exception("Connection closed during AES key transfer")
-                encrypted_aes_key += chunk
+            encrypted_aes_key = recv_frame(client_socket, HANDSHAKE_MAX_SIZE)
             
             aes_key = RSAHandler.decrypt_rsa(encrypted_aes_key, self.private_key)
+            # One AEAD context for every handshake/control message of this session
+            client_cipher = EncryptionHandler(aes_key)
             self._log(f"[{address}] 🔐 Received and decrypted AES-256 key")
             
             # Step 3: Receive encrypted authentication with length prefix
-            auth_len_bytes = b''
-            while len(auth_len_bytes) < 4:
-                chunk = client_socket.recv(4 - len(auth_len_bytes))
-                if not chunk:
-                    raise Exception("Connection closed during auth length receive")
-                auth_len_bytes += chunk
-            
-            auth_len = int.from_bytes(auth_len_bytes, 'big')
-            encrypted_token = b''
-            while len(encrypted_token) < auth_len:
-                chunk = client_socket.recv(min(auth_len - len(encrypted_token), 4096))
-                if not chunk:
-                    raise Exception("Connection closed during auth")
-                encrypted_token += chunk
-            auth_json = self.encryption.decrypt_aes(encrypted_token, aes_key)
+            encrypted_token = recv_frame(client_socket, HANDSHAKE_MAX_SIZE)
+            auth_json = client_cipher.decrypt(encrypted_token)
             
             # Step 4: Validate credentials
-            username, password, timestamp = self.auth.parse_auth_data(auth_json)
+            username, password, timestamp, cipher_suites = self.auth.parse_auth_request(auth_json)
             
             if self.auth.validate_credentials(username, password):
-                # Authentication successful
+                # Authentication successful - settle the tunnel cipher suite
+                cipher_suite = select_cipher_suite(cipher_suites)
                 response = self.auth.create_auth_response(
                     success=True,
                     message='VPN tunnel established - Full forwarding enabled',
                     server_info={
                         'server_ip': self.host,
                         'features': ['tunneling', 'flow_control', 'encryption'],
-                        'encryption': 'AES-256-CBC',
+                        'encryption': cipher_suite,
+                        'cipher_suite': cipher_suite,
                         'key_exchange': 'RSA-2048-OAEP'
                     }
                 )
-                encrypted_response = self.encryption.encrypt_aes(response, aes_key)
+                encrypted_response = client_cipher.encrypt(response)
                 # Send with length prefix for reliable transmission
-                resp_len = len(encrypted_response)
-                client_socket.sendall(resp_len.to_bytes(4, 'big'))
-                client_socket.sendall(encrypted_response)
+                send_frame(client_socket, encrypted_response)
                 
                 self._log(f"[{address}] ✅ Authenticated as '{username}'")
                 self._log(f"[{address}] 🔒 Secure tunnel established")
                 self._log(f"[{address}] 📊 Flow control initialized (window: {flow_controller.cwnd} bytes)")
                 
                 # Initialize tunnel manager
-                tunnel_manager = TunnelManager(aes_key, client_socket)
+                tunnel_manager = TunnelManager(aes_key, client_socket, cipher_suite)
                 
                 # Store client info
                 self.clients[address] = {
                     'socket': client_socket,
                     'aes_key': aes_key,
+                    'cipher': client_cipher,
                     'username': username,
                     'authenticated': True,
                     'connected_at': time.time(),
@@ -214,8 +235,8 @@ class VPNServerEnhanced:
                     success=False,
                     message='Authentication failed: Invalid credentials'
                 )
-                encrypted_response = self.encryption.encrypt_aes(response, aes_key)
-                client_socket.send(encrypted_response)
+                encrypted_response = client_cipher.encrypt(response)
+                send_frame(client_socket, encrypted_response)
                 self._log(f"[{address}] ❌ Authentication failed", level='WARNING')
                 client_socket.close()
         
@@ -230,6 +251,10 @@ class VPNServerEnhanced:
                 self.global_stats['active_tunnels'] -= 1
                 del self.clients[address]
             
+            # Nothing references the controller any more - recycle it
+            flow_controller.reset()
+            self._flow_pool.append(flow_controller)
+            
             try:
                 client_socket.close()
             except:
@@ -242,8 +267,13 @@ class VPNServerEnhanced:
         self.running = False
         self._log("Server shutting down...")
         
-        # Close all client connections
+        # Close all client connections; shutdown() first so threads
+        # blocked in recv on them wake up
         for address, client_info in list(self.clients.items()):
+            try:
+                client_info['socket'].shutdown(socket.SHUT_RDWR)
+            except:
+                pass
             try:
                 client_info['socket'].close()
             except:
@@ -255,6 +285,12 @@ class VPNServerEnhanced:
                 self.server_socket.close()
             except:
                 pass
+        
+        if self.pool:
+            self.pool.shutdown(wait=False)
+        
+        if self._stats_timer:
+            self._stats_timer.cancel()
     
     def _handle_tunnel_with_flow_control(
         self, 
@@ -266,14 +302,12 @@ class VPNServerEnhanced:
     ):
         """Handle VPN tunnel with flow control and congestion management"""
         
-        # Start tunnel manager (it will handle all socket reading)
-        tunnel_manager.start_tunnel()
-        
         try:
-            # Just wait for tunnel to finish - tunnel_manager handles all communication
-            while self.running and tunnel_manager.running:
-                time.sleep(1.0)
-                # Flow control stats are updated by tunnel_manager as needed
+            # Run the tunnel in this thread until the client disconnects -
+            # tunnel_manager handles all communication (shutdown() wakes it
+            # by shutting the client socket down)
+            tunnel_manager.run_tunnel()
+            # Flow control stats are updated by tunnel_manager as needed
         
         except Exception as e:
             self._log(f"[{address}] Tunnel error: {e}", level='ERROR')
@@ -282,7 +316,7 @@ class VPNServerEnhanced:
     def _send_statistics(
         self, 
         client_socket: socket.socket, 
-        aes_key: bytes,
+        cipher: EncryptionHandler,
         tunnel_manager: TunnelManager,
         flow_controller: FlowController
     ):
@@ -298,33 +332,41 @@ class VPNServerEnhanced:
             }
         }
         
-        stats_json = json.dumps(stats)
-        encrypted_stats = self.encryption.encrypt_aes(stats_json, aes_key)
-        client_socket.send(encrypted_stats)
+        stats_json = orjson.dumps(stats) if orjson else json.dumps(stats)
+        encrypted_stats = cipher.encrypt(stats_json)
+        # Length prefix and payload in one scatter/gather send, like every other reply
+        send_frame(client_socket, encrypted_stats)
     
-    def _stats_reporter(self):
-        """Periodically report server statistics"""
-        while self.running:
-            time.sleep(30)  # Report every 30 seconds
-            
-            uptime = time.time() - self.global_stats['uptime_start']
-            self._log("="*70)
-            self._log("📊 SERVER STATISTICS")
-            self._log(f"   Uptime: {uptime:.0f}s")
-            self._log(f"   Total Connections: {self.global_stats['total_connections']}")
-            self._log(f"   Active Tunnels: {self.global_stats['active_tunnels']}")
-            self._log(f"   Total Data Forwarded: {self.global_stats['total_bytes_forwarded'] / 1024:.2f} KB")
-            self._log("="*70)
+    def _schedule_stats_report(self):
+        """Arm a one-shot timer for the next statistics report"""
+        self._stats_timer = threading.Timer(config.STATS_REPORT_INTERVAL, self._report_stats)
+        self._stats_timer.daemon = True
+        self._stats_timer.start()
+    
+    def _report_stats(self):
+        """Report server statistics, then schedule the next report"""
+        if not self.running:
+            return
+        
+        uptime = time.time() - self.global_stats['uptime_start']
+        self._log("="*70)
+        self._log("📊 SERVER STATISTICS")
+        self._log(f"   Uptime: {uptime:.0f}s")
+        self._log(f"   Total Connections: {self.global_stats['total_connections']}")
+        self._log(f"   Active Tunnels: {self.global_stats['active_tunnels']}")
+        self._log(f"   Total Data Forwarded: {self.global_stats['total_bytes_forwarded'] / 1024:.2f} KB")
+        self._log("="*70)
+        
+        self._schedule_stats_report()
     
     def stop(self):
         """Stop the VPN server"""
-        self.running = False
-        if self.server_socket:
-            self.server_socket.close()
+        # Pool workers are not daemon threads, so connected clients must be
+        # woken and closed or the interpreter waits on them at exit
+        self.shutdown()
         self._log("Server stopped")
     
     def _log(self, message: str, level: str = 'INFO'):
-        """Log message with timestamp"""
+        """Log message with timestamp (formatted by the logging handler)"""
         if config.VERBOSE_LOGGING or level != 'INFO':
-            timestamp = time.strftime("%H:%M:%S")
-            print(f"[{timestamp}] [{level}] {message}")
+            logger.log(getattr(logging, level, logging.INFO), message)
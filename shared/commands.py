@@ -0,0 +1,115 @@
+"""
+Tunnel Commands
+Binary request encoding shared by the VPN client and server
+"""
+
+import struct
+from typing import List, Tuple
+
+# Opcodes: the first byte of a decrypted request frame. Anything else
+# (first byte not a known opcode) is treated as a plain data packet.
+CMD_FORWARD = 1    # Address header + request bytes: one-shot forward
+CMD_CONNECT = 2    # Address header: hand the tunnel over to a raw stream
+CMD_KEEPALIVE = 3
+CMD_STATS = 4
+CMD_OPEN = 5       # Address header: open a persistent connection
+CMD_SEND = 6       # Connection header + request bytes
+CMD_CLOSE = 7      # Connection header
+
+# Opcode, destination port, host name length (the host name follows)
+ADDRESS_HEADER = struct.Struct('!BHB')
+# Opcode, persistent connection id
+CONNECTION_HEADER = struct.Struct('!BI')
+
+# Handshake credentials: format version, timestamp, then the lengths of
+# the username, password and comma-separated cipher suite list that follow.
+# The version byte never equals '{', so servers can still tell the older
+# JSON credentials apart.
+AUTH_VERSION = 1
+AUTH_HEADER = struct.Struct('!BdHHH')
+
+
+def pack_address(op: int, host: str, port: int, payload: bytes = b'') -> bytes:
+    """
+    Encode a command addressed to host:port
+    
+    Args:
+        op: CMD_FORWARD, CMD_CONNECT or CMD_OPEN
+        host: Destination host name or IP address
+        port: Destination port
+        payload: Bytes to forward, if any
+        
+    Returns:
+        bytes: Encoded request
+    """
+    host_bytes = host.encode('idna')
+    return ADDRESS_HEADER.pack(op, port, len(host_bytes)) + host_bytes + payload
+
+
+def unpack_address(request: bytes) -> Tuple[str, int, bytes]:
+    """Decode an address command into (host, port, payload)"""
+    _, port, host_len = ADDRESS_HEADER.unpack_from(request)
+    start = ADDRESS_HEADER.size
+    host = request[start:start + host_len].decode('ascii')
+    return host, port, request[start + host_len:]
+
+
+def pack_connection(op: int, conn_id: int, payload: bytes = b'') -> bytes:
+    """
+    Encode a command for a persistent connection
+    
+    Args:
+        op: CMD_SEND or CMD_CLOSE
+        conn_id: Connection id returned by CMD_OPEN
+        payload: Bytes to send, if any
+        
+    Returns:
+        bytes: Encoded request
+    """
+    return CONNECTION_HEADER.pack(op, conn_id) + payload
+
+
+def unpack_connection(request: bytes) -> Tuple[int, bytes]:
+    """Decode a connection command into (conn_id, payload)"""
+    _, conn_id = CONNECTION_HEADER.unpack_from(request)
+    return conn_id, request[CONNECTION_HEADER.size:]
+
+
+def pack_auth(username: str, password: str, timestamp: float, cipher_suites=()) -> bytes:
+    """
+    Encode handshake credentials
+    
+    Args:
+        username: Username
+        password: Password
+        timestamp: Client time (seconds since the epoch)
+        cipher_suites: Tunnel cipher suites offered, preferred first
+        
+    Returns:
+        bytes: Encoded credentials (encrypted by the caller)
+    """
+    user = username.encode()
+    secret = password.encode()
+    suites = ','.join(cipher_suites).encode('ascii')
+    return AUTH_HEADER.pack(AUTH_VERSION, timestamp, len(user), len(secret), len(suites)) + user + secret + suites
+
+
+def unpack_auth(data: bytes) -> Tuple[str, str, float, List[str]]:
+    """
+    Decode credentials into (username, password, timestamp, cipher_suites)
+    
+    Raises:
+        ValueError: If the version or lengths don't match the data
+    """
+    version, timestamp, user_len, secret_len, suites_len = AUTH_HEADER.unpack_from(data)
+    start = AUTH_HEADER.size
+    if version != AUTH_VERSION or start + user_len + secret_len + suites_len != len(data):
+        raise ValueError("Malformed credentials")
+    
+    view = memoryview(data)
+    username = str(view[start:start + user_len], 'utf-8')
+    start += user_len
+    password = str(view[start:start + secret_len], 'utf-8')
+    start += secret_len
+    suites = str(view[start:], 'ascii')
+    return username, password, timestamp, suites.split(',') if suites else []
@@ -26,3 +26,11 @@ STATUS_SUCCESS = 'success'
 STATUS_ERROR = 'error'
 STATUS_CONNECTED = 'connected'
 STATUS_DISCONNECTED = 'disconnected'
+
+# Fixed tunnel reply status lines. A reply is one of these (or another JSON
+# object) followed by an optional raw body; the fixed ones are matched as
+# bytes on the hot path instead of being JSON-encoded/decoded per packet.
+FORWARD_OK_HEADER = b'{"status": "success"}\n'
+# Streamed reply: the body follows in further frames, ended by an empty frame
+STREAM_OK_HEADER = b'{"status": "success", "stream": true}\n'
+KEEPALIVE_ACK = b'{"status": "ok", "type": "keepalive_ack"}'
@@ -0,0 +1,105 @@
+"""
+Message Framing
+Length-prefixed framing shared by the VPN client and server
+"""
+
+import socket
+import struct
+
+# Scatter/gather send is not available on every platform (e.g. Windows)
+HAS_SENDMSG = hasattr(socket.socket, 'sendmsg')
+
+# Ask the kernel to fill the whole buffer in one recv where supported
+RECV_WAITALL = getattr(socket, 'MSG_WAITALL', 0)
+
+# 4-byte big-endian frame length prefix
+LENGTH_PREFIX = struct.Struct('!I')
+
+
+def send_frame(sock: socket.socket, payload: bytes):
+    """
+    Send one frame: a 4-byte big-endian length prefix followed by payload
+    
+    Args:
+        sock: Connected socket
+        payload: Frame payload (already encrypted)
+    """
+    send_frame_parts(sock, (payload,))
+
+
+def send_frame_parts(sock: socket.socket, parts: tuple):
+    """
+    Send one frame whose payload is split across several buffers
+    
+    Uses sendmsg so the prefix and every part leave in a single writev(2)
+    without first being copied into one buffer. A short write (full send
+    buffer) is finished with sendall.
+    
+    Args:
+        sock: Connected socket
+        parts: Payload pieces, sent back to back (e.g. nonce, ciphertext)
+    """
+    header = LENGTH_PREFIX.pack(sum(map(len, parts)))
+    if not HAS_SENDMSG:
+        sock.sendall(b''.join((header, *parts)))
+        return
+    
+    buffers = (header, *parts)
+    sent = sock.sendmsg(buffers)
+    for buf in buffers:
+        if sent >= len(buf):
+            sent -= len(buf)
+            continue
+        sock.sendall(memoryview(buf)[sent:])
+        sent = 0
+
+
+def recv_exact(sock: socket.socket, n: int) -> bytes:
+    """
+    Receive exactly n bytes
+    
+    Reads straight into one preallocated buffer instead of concatenating
+    chunks, so large messages are copied only once. MSG_WAITALL lets the
+    kernel satisfy the read in a single call; the loop only runs again on
+    a short read (timeout, signal).
+    
+    Args:
+        sock: Connected socket
+        n: Number of bytes to read
+        
+    Returns:
+        bytes: The n bytes received
+        
+    Raises:
+        ConnectionError: If the peer closes before n bytes arrive
+    """
+    buf = bytearray(n)
+    view = memoryview(buf)
+    received = 0
+    while received < n:
+        count = sock.recv_into(view[received:], n - received, RECV_WAITALL)
+        if not count:
+            raise ConnectionError(f"Connection closed after {received}/{n} bytes")
+        received += count
+    return bytes(buf)
+
+
+def recv_frame(sock: socket.socket, max_size: int) -> bytes:
+    """
+    Receive one length-prefixed frame
+    
+    Args:
+        sock: Connected socket
+        max_size: Largest payload accepted (the buffer is allocated up front)
+        
+    Returns:
+        bytes: Frame payload
+        
+    Raises:
+        ConnectionError: If the peer closes mid-frame
+        ValueError: If the announced length exceeds max_size
+    """
+    size = LENGTH_PREFIX.unpack(recv_exact(sock, 4))[0]
+    if size > max_size:
+        raise ValueError(f"Frame of {size} bytes exceeds limit of {max_size}")
+    return recv_exact(sock, size)